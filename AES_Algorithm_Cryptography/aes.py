@@ -114,6 +114,82 @@ def inv_mix_columns(s):
     mix_columns(s)
 
 
+def inv_sub_mix_columns(s):
+    # InvSubBytes followed by InvMixColumns, with one Td lookup per byte.
+    for column in s:
+        w = Td0[column[0]] ^ Td1[column[1]] ^ Td2[column[2]] ^ Td3[column[3]]
+        column[0] = w >> 24
+        column[1] = (w >> 16) & 0xFF
+        column[2] = (w >> 8) & 0xFF
+        column[3] = w & 0xFF
+
+
+# The same round steps on a flat 16 byte bytearray state, modified in place.
+# Byte 4*i + j is s[i][j] of the matrix representation.
+
+def sub_bytes_flat(s):
+    for i in range(16):
+        s[i] = s_box[s[i]]
+
+
+def inv_sub_bytes_flat(s):
+    for i in range(16):
+        s[i] = inv_s_box[s[i]]
+
+
+def shift_rows_flat(s):
+    t = s[1]; s[1] = s[5]; s[5] = s[9]; s[9] = s[13]; s[13] = t
+    t = s[2]; s[2] = s[10]; s[10] = t
+    t = s[6]; s[6] = s[14]; s[14] = t
+    t = s[15]; s[15] = s[11]; s[11] = s[7]; s[7] = s[3]; s[3] = t
+
+
+def inv_shift_rows_flat(s):
+    t = s[13]; s[13] = s[9]; s[9] = s[5]; s[5] = s[1]; s[1] = t
+    t = s[2]; s[2] = s[10]; s[10] = t
+    t = s[6]; s[6] = s[14]; s[14] = t
+    t = s[3]; s[3] = s[7]; s[7] = s[11]; s[11] = s[15]; s[15] = t
+
+
+def add_round_key_flat(s, k):
+    for i in range(16):
+        s[i] ^= k[i]
+
+
+def mix_columns_flat(s):
+    # see Sec 4.1.2 in The Design of Rijndael
+    for i in range(0, 16, 4):
+        a0, a1, a2, a3 = s[i], s[i+1], s[i+2], s[i+3]
+        t = a0 ^ a1 ^ a2 ^ a3
+        s[i] = a0 ^ t ^ xtime(a0 ^ a1)
+        s[i+1] = a1 ^ t ^ xtime(a1 ^ a2)
+        s[i+2] = a2 ^ t ^ xtime(a2 ^ a3)
+        s[i+3] = a3 ^ t ^ xtime(a3 ^ a0)
+
+
+def inv_mix_columns_flat(s):
+    # see Sec 4.1.3 in The Design of Rijndael
+    for i in range(0, 16, 4):
+        u = xtime(xtime(s[i] ^ s[i+2]))
+        v = xtime(xtime(s[i+1] ^ s[i+3]))
+        s[i] ^= u
+        s[i+1] ^= v
+        s[i+2] ^= u
+        s[i+3] ^= v
+
+    mix_columns_flat(s)
+
+
+def inv_sub_mix_columns_flat(s):
+    # InvSubBytes followed by InvMixColumns, with one Td lookup per byte.
+    for i in range(0, 16, 4):
+        w = Td0[s[i]] ^ Td1[s[i+1]] ^ Td2[s[i+2]] ^ Td3[s[i+3]]
+        s[i] = w >> 24
+        s[i+1] = (w >> 16) & 0xFF
+        s[i+2] = (w >> 8) & 0xFF
+        s[i+3] = w & 0xFF
+
+
 r_con = (
     0x00, 0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40,
     0x80, 0x1B, 0x36, 0x6C, 0xD8, 0xAB, 0x4D, 0x9A,
@@ -145,6 +221,38 @@ def inc_bytes(a):
             break
     return bytes(out)
 
+def xor_into(target, target_offset, data, data_offset=0):
+    """ XORs 16 bytes of `data` into the bytearray `target`, in place. """
+    for i in range(16):
+        target[target_offset + i] ^= data[data_offset + i]
+
+def xor_span(a, b):
+    """
+    Returns the XOR of two equally long byte strings in one bulk operation:
+    NumPy `bitwise_xor` on spans of 256 bytes or more when it is installed,
+    otherwise a single big integer XOR.
+    """
+    if np is not None and len(a) >= 256:
+        return np.bitwise_xor(np.frombuffer(a, dtype=np.uint8),
+                              np.frombuffer(b, dtype=np.uint8)).tobytes()
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+def counter_blocks(counter, count):
+    """
+    Returns the `count` consecutive 16 byte counter blocks starting at the
+    integer `counter`, wrapping around at 2^128 like `inc_bytes`. With NumPy
+    all counters are built in one vectorized step on 64-bit halves.
+    """
+    counter %= 1 << 128
+    if np is None or count < 16:
+        return b''.join(((counter + i) % (1 << 128)).to_bytes(16, 'big') for i in range(count))
+    low = np.uint64(counter & 0xFFFFFFFFFFFFFFFF)
+    blocks = np.empty((count, 2), dtype='>u8')
+    blocks[:, 1] = np.arange(count, dtype=np.uint64) + low
+    # A low half smaller than the start has wrapped and carries into the high half.
+    blocks[:, 0] = (blocks[:, 1] < low).astype(np.uint64) + np.uint64(counter >> 64)
+    return blocks.tobytes()
+
 def pad(plaintext):
     """
     Pads the given plaintext with PKCS#7 padding to a multiple of 16 bytes.
@@ -171,6 +279,298 @@ def split_blocks(message, block_size=16):
         return [message[i:i+16] for i in range(0, len(message), block_size)]
 
 
+def _build_round_tables():
+    """
+    Builds the T-tables used by the lookup-table round engine.
+
+    Each entry of `Te0` holds the column (2*S[x], S[x], S[x], 3*S[x]) packed
+    as a big-endian 32-bit word, so one lookup performs SubBytes and the
+    MixColumns multiplication of a byte at once. `Te1`..`Te3` are the same
+    table rotated by one byte each, which takes care of ShiftRows. `Td0`..`Td3`
+    do the same for the inverse cipher with (14, 9, 13, 11) and the inverse
+    S-box. See Sec 4.2 in The Design of Rijndael.
+    """
+    ror8 = lambda w: ((w >> 8) | (w << 24)) & 0xFFFFFFFF
+
+    def mul(a, b):
+        # Multiplication in GF(2^8), only used to build the tables.
+        p = 0
+        while b:
+            if b & 1:
+                p ^= a
+            a = xtime(a)
+            b >>= 1
+        return p
+
+    te = [[], [], [], []]
+    td = [[], [], [], []]
+    for x in range(256):
+        s = s_box[x]
+        w = (mul(s, 2) << 24) | (s << 16) | (s << 8) | mul(s, 3)
+        i = inv_s_box[x]
+        v = (mul(i, 14) << 24) | (mul(i, 9) << 16) | (mul(i, 13) << 8) | mul(i, 11)
+        for t in range(4):
+            te[t].append(w)
+            td[t].append(v)
+            w, v = ror8(w), ror8(v)
+
+    return tuple(map(tuple, te)), tuple(map(tuple, td))
+
+(Te0, Te1, Te2, Te3), (Td0, Td1, Td2, Td3) = _build_round_tables()
+
+
+from functools import cached_property
+from struct import pack, pack_into, unpack, unpack_from
+
+
+# NumPy is optional: it is only used by the batch API (`AES.encrypt_blocks`
+# and `AES.decrypt_blocks`), which falls back to one block at a time without it.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Byte i of a block is row i % 4 of column i // 4, as in `bytes2matrix`.
+shift_rows_order = tuple(4 * ((i // 4 + i % 4) % 4) + i % 4 for i in range(16))
+inv_shift_rows_order = tuple(4 * ((i // 4 - i % 4) % 4) + i % 4 for i in range(16))
+
+if np is not None:
+    s_box_array = np.array(s_box, dtype=np.uint8)
+    inv_s_box_array = np.array(inv_s_box, dtype=np.uint8)
+    shift_rows_array = np.array(shift_rows_order)
+    inv_shift_rows_array = np.array(inv_shift_rows_order)
+
+
+def xtime_array(a):
+    """ `xtime` over a whole uint8 array. """
+    return (a << 1) ^ ((a >> 7) * 0x1B)
+
+
+def mix_columns_array(s):
+    """
+    MixColumns over an (N, 16) uint8 array of states, returning a new array.
+    """
+    c = s.reshape(-1, 4, 4)
+    a0, a1, a2, a3 = c[:, :, 0], c[:, :, 1], c[:, :, 2], c[:, :, 3]
+    t = a0 ^ a1 ^ a2 ^ a3
+    out = np.empty_like(c)
+    out[:, :, 0] = a0 ^ t ^ xtime_array(a0 ^ a1)
+    out[:, :, 1] = a1 ^ t ^ xtime_array(a1 ^ a2)
+    out[:, :, 2] = a2 ^ t ^ xtime_array(a2 ^ a3)
+    out[:, :, 3] = a3 ^ t ^ xtime_array(a3 ^ a0)
+    return out.reshape(-1, 16)
+
+
+def inv_mix_columns_array(s):
+    """
+    InvMixColumns over an (N, 16) uint8 array of states, returning a new array.
+    """
+    c = s.reshape(-1, 4, 4).copy()
+    u = xtime_array(xtime_array(c[:, :, 0] ^ c[:, :, 2]))
+    v = xtime_array(xtime_array(c[:, :, 1] ^ c[:, :, 3]))
+    c[:, :, 0] ^= u
+    c[:, :, 1] ^= v
+    c[:, :, 2] ^= u
+    c[:, :, 3] ^= v
+    return mix_columns_array(c.reshape(-1, 16))
+
+
+def encrypt_array(states, keys):
+    """
+    Encrypts an (N, 16) uint8 array of states, returning a new array. `keys`
+    holds the round keys, (n_rounds + 1, 16) for a single key or
+    (n_rounds + 1, N, 16) for one key per state.
+    """
+    s = states ^ keys[0]
+    for i in range(1, len(keys) - 1):
+        # SubBytes and ShiftRows commute, so both are one fancy index.
+        s = mix_columns_array(s_box_array[s[:, shift_rows_array]])
+        s ^= keys[i]
+    return s_box_array[s[:, shift_rows_array]] ^ keys[-1]
+
+
+def decrypt_array(states, keys):
+    """
+    Decrypts an (N, 16) uint8 array of states, returning a new array. Takes
+    the same round keys as `encrypt_array`.
+    """
+    s = states ^ keys[-1]
+    s = inv_s_box_array[s[:, inv_shift_rows_array]]
+    for i in range(len(keys) - 2, 0, -1):
+        s ^= keys[i]
+        s = inv_s_box_array[inv_mix_columns_array(s)[:, inv_shift_rows_array]]
+    return s ^ keys[0]
+
+
+def expand_keys_array(keys):
+    """
+    Expands N keys of the same size at once. `keys` is an (N, 16, 24 or 32)
+    uint8 array; returns the (n_rounds + 1, N, 16) round keys for
+    `encrypt_array`, each step of the key schedule running on all keys.
+    """
+    n_keys, key_size = keys.shape
+    iteration_size = key_size // 4
+    n_rounds = AES.rounds_by_key_size[key_size]
+    words = np.empty((4 * (n_rounds + 1), n_keys, 4), dtype=np.uint8)
+    words[:iteration_size] = keys.reshape(n_keys, iteration_size, 4).transpose(1, 0, 2)
+    for i in range(iteration_size, len(words)):
+        word = words[i - 1]
+        if i % iteration_size == 0:
+            # Rotate, map to the S-box and XOR with R-CON, see `_expand_key`.
+            word = s_box_array[word[:, [1, 2, 3, 0]]]
+            word[:, 0] ^= r_con[i // iteration_size]
+        elif key_size == 32 and i % iteration_size == 4:
+            word = s_box_array[word]
+        words[i] = words[i - iteration_size] ^ word
+    return words.reshape(n_rounds + 1, 4, n_keys, 4).transpose(0, 2, 1, 3).reshape(n_rounds + 1, n_keys, 16)
+
+
+# Bitsliced engine. The bits of many blocks are packed into eight big
+# integers ("planes"): bit 16*j + i of plane k is bit k of byte i of block j.
+# Every round step then becomes a fixed sequence of AND, XOR and shifts over
+# whole planes, the S-box being evaluated as a Boolean circuit (inversion in
+# GF(2^8) followed by the affine map), so there are no table lookups indexed
+# by secret data and all blocks of a batch are processed at once.
+
+_plane_digits = [bytes.maketrans(bytes(range(256)), bytes(0x30 | (b >> k) & 1 for b in range(256)))
+                 for k in range(8)]
+_plane_bits = [bytes.maketrans(b'01', bytes([0, 1 << k])) for k in range(8)]
+
+
+def pack_bitsliced(data):
+    """
+    Packs a multiple of 16 bytes into the eight bit planes.
+    """
+    return [int(data.translate(table)[::-1] or b'0', 2) for table in _plane_digits]
+
+
+def unpack_bitsliced(planes, length):
+    """
+    Unpacks eight bit planes back into `length` bytes.
+    """
+    out = 0
+    for plane, table in zip(planes, _plane_bits):
+        digits = format(plane, '0%db' % length).encode('ascii')[::-1]
+        out |= int.from_bytes(digits.translate(table), 'big')
+    return out.to_bytes(length, 'big')
+
+
+def _permutation_shifts(order):
+    """
+    Returns (shift, mask) pairs moving byte order[i] of each block to byte i.
+    """
+    masks = {}
+    for i, j in enumerate(order):
+        masks[j - i] = masks.get(j - i, 0) | 1 << i
+    return sorted(masks.items())
+
+_shift_rows_shifts = _permutation_shifts(shift_rows_order)
+_inv_shift_rows_shifts = _permutation_shifts(inv_shift_rows_order)
+# Rotations of the rows of each column, by 1 and 2 positions.
+_rotate_column_shifts = _permutation_shifts([4 * (i // 4) + (i + 1) % 4 for i in range(16)])
+_rotate_column2_shifts = _permutation_shifts([4 * (i // 4) + (i + 2) % 4 for i in range(16)])
+
+
+def _permute_planes(planes, shifts, repeat):
+    out = []
+    for plane in planes:
+        result = 0
+        for shift, mask in shifts:
+            part = plane >> shift if shift >= 0 else plane << -shift
+            result |= part & (mask * repeat)
+        out.append(result)
+    return out
+
+
+def _reduce_planes(c):
+    # x^8 = x^4 + x^3 + x + 1 in the AES field.
+    for k in range(14, 7, -1):
+        c[k - 4] ^= c[k]
+        c[k - 5] ^= c[k]
+        c[k - 7] ^= c[k]
+        c[k - 8] ^= c[k]
+    return c[:8]
+
+
+def _gf_multiply_planes(a, b):
+    c = [0] * 15
+    for i in range(8):
+        for j in range(8):
+            c[i + j] ^= a[i] & b[j]
+    return _reduce_planes(c)
+
+
+def _gf_square_planes(a):
+    c = [0] * 15
+    for i in range(8):
+        c[2 * i] = a[i]
+    return _reduce_planes(c)
+
+
+def _gf_inverse_planes(x):
+    # x^254 = x^-1, and 0 maps to 0 as the S-box requires.
+    x2 = _gf_square_planes(x)
+    x3 = _gf_multiply_planes(x2, x)
+    x12 = _gf_square_planes(_gf_square_planes(x3))
+    x15 = _gf_multiply_planes(x12, x3)
+    x240 = x15
+    for _ in range(4):
+        x240 = _gf_square_planes(x240)
+    return _gf_multiply_planes(_gf_multiply_planes(x240, x12), x2)
+
+
+def sub_bytes_bitsliced(planes, ones):
+    """
+    SubBytes on bit planes, `ones` being a plane with every bit set.
+    """
+    b = _gf_inverse_planes(planes)
+    return [b[i] ^ b[(i + 4) % 8] ^ b[(i + 5) % 8] ^ b[(i + 6) % 8] ^ b[(i + 7) % 8] ^
+            (ones if 0x63 >> i & 1 else 0) for i in range(8)]
+
+
+def inv_sub_bytes_bitsliced(planes, ones):
+    """
+    InvSubBytes on bit planes, `ones` being a plane with every bit set.
+    """
+    b = planes
+    b = [b[(i + 2) % 8] ^ b[(i + 5) % 8] ^ b[(i + 7) % 8] ^ (ones if 0x05 >> i & 1 else 0)
+         for i in range(8)]
+    return _gf_inverse_planes(b)
+
+
+def _xtime_planes(a):
+    # Shift left, reducing by 0x1B (bits 0, 1, 3 and 4) when bit 7 was set.
+    return [a[7], a[0] ^ a[7], a[1], a[2] ^ a[7], a[3] ^ a[7], a[4], a[5], a[6]]
+
+
+def mix_columns_bitsliced(planes, repeat):
+    """
+    MixColumns on bit planes, see `mix_single_column`.
+    """
+    rotated = _permute_planes(planes, _rotate_column_shifts, repeat)
+    rotated2 = _permute_planes(rotated, _rotate_column_shifts, repeat)
+    rotated3 = _permute_planes(rotated2, _rotate_column_shifts, repeat)
+    doubled = _xtime_planes([a ^ r for a, r in zip(planes, rotated)])
+    # a ^ t ^ xtime(a ^ next), where t = a ^ r ^ r2 ^ r3 cancels out a.
+    return [r ^ r2 ^ r3 ^ d for r, r2, r3, d in zip(rotated, rotated2, rotated3, doubled)]
+
+
+def inv_mix_columns_bitsliced(planes, repeat):
+    """
+    InvMixColumns on bit planes, see `inv_mix_columns`.
+    """
+    opposite = _permute_planes(planes, _rotate_column2_shifts, repeat)
+    u = _xtime_planes(_xtime_planes([a ^ o for a, o in zip(planes, opposite)]))
+    return mix_columns_bitsliced([a ^ w for a, w in zip(planes, u)], repeat)
+
+
+class AuthenticationError(AssertionError):
+    """
+    Raised when a ciphertext fails its HMAC or tag check. Unlike an `assert`,
+    it is still raised under `python -O`.
+    """
+
+
 class AES:
     """
     Class for AES-128 encryption with CBC mode and PKCS#7.
@@ -179,14 +579,68 @@ class AES:
     management. Unless you need that, please use `encrypt` and `decrypt`.
     """
     rounds_by_key_size = {16: 10, 24: 12, 32: 14}
-    def __init__(self, master_key):
+    engines = ('matrix', 'table', 'bitslice', 'flat')
+    def __init__(self, master_key, engine='matrix'):
         """
         Initializes the object with a given key.
+
+        `engine` selects the round implementation used by `encrypt_block` and
+        `decrypt_block`: 'matrix' runs each round step over a 4x4 matrix,
+        'table' uses the precomputed T-tables on four 32-bit column words,
+        'bitslice' evaluates the rounds as Boolean circuits over bit planes,
+        without secret-dependent table lookups, and is fastest through
+        `encrypt_blocks`/`decrypt_blocks` on many blocks at once. All produce
+        the same output. 'flat' runs the matrix steps in place on a 16 byte
+        bytearray, see `encrypt_state`.
         """
         assert len(master_key) in AES.rounds_by_key_size
+        assert engine in AES.engines, 'Unknown engine %r.' % (engine,)
         self.n_rounds = AES.rounds_by_key_size[len(master_key)]
+        self.engine = engine
+        # The other key schedules are derived from these on first use, so each
+        # engine only pays for the ones it needs.
         self._key_matrices = self._expand_key(master_key)
 
+        if engine == 'table':
+            self.encrypt_block = self._encrypt_block_table
+            self.decrypt_block = self._decrypt_block_table
+        elif engine == 'bitslice':
+            self._key_planes = [pack_bitsliced(bytes(b for column in matrix for b in column))
+                                for matrix in self._key_matrices]
+            self.encrypt_block = self._encrypt_block_bitsliced
+            self.decrypt_block = self._decrypt_block_bitsliced
+        elif engine == 'flat':
+            self._round_keys = [bytearray(b for column in matrix for b in column)
+                                for matrix in self._key_matrices]
+            self.encrypt_state = self._encrypt_state_flat
+            self.decrypt_state = self._decrypt_state_flat
+            self.encrypt_block = self._encrypt_block_flat
+            self.decrypt_block = self._decrypt_block_flat
+
+    def zeroize(self):
+        """
+        Overwrites every expanded round key held by this object with zeros.
+        The object must not be used afterwards.
+
+        This is best effort: Python may still hold copies of the master key
+        or of intermediate values elsewhere in memory.
+        """
+        # Schedules not computed yet are absent from the instance dict.
+        computed = vars(self)
+        for matrix in self._key_matrices + computed.get('_decrypt_key_matrices', []):
+            for column in matrix:
+                column[:] = [0] * len(column)
+        for key in computed.get('_round_keys', []) + computed.get('_decrypt_round_keys', []):
+            key[:] = bytes(len(key))
+        for words in (computed.get('_encrypt_words', []), computed.get('_decrypt_words', []),
+                      *computed.get('_key_planes', [])):
+            words[:] = [0] * len(words)
+        if '_key_array' in computed:
+            self._key_array.fill(0)
+        # The GHASH table holds multiples of the hash key E_K(0).
+        for row in computed.pop('_gcm_table', []):
+            row[:] = [0] * len(row)
+
     def _expand_key(self, master_key):
         """
         Expands and returns a list of key matrices for the given master_key.
@@ -217,12 +671,239 @@ class AES:
                 word = [s_box[b] for b in word]
 
             # XOR with equivalent word from previous iteration.
-            word = xor_bytes(word, key_columns[-iteration_size])
+            # Kept as a list so `zeroize` can overwrite it.
+            word = list(xor_bytes(word, key_columns[-iteration_size]))
             key_columns.append(word)
 
         # Group key words in 4x4 byte matrices.
         return [key_columns[4*i : 4*(i+1)] for i in range(len(key_columns) // 4)]
 
+    @cached_property
+    def _encrypt_words(self):
+        """
+        The encryption round keys as a flat list of 32-bit column words, for
+        the lookup-table engine.
+        """
+        return [int.from_bytes(bytes(column), 'big')
+                for matrix in self._key_matrices for column in matrix]
+
+    @cached_property
+    def _decrypt_words(self):
+        """
+        The decryption round keys as a flat list of 32-bit column words.
+
+        The decryption schedule is the one of the equivalent inverse cipher:
+        round keys in reverse order, with InvMixColumns applied to all but the
+        first and last one.
+        """
+        words = self._encrypt_words
+        decrypt_words = []
+        for round in range(self.n_rounds, -1, -1):
+            round_words = words[4*round : 4*(round+1)]
+            if 0 < round < self.n_rounds:
+                # Td[S[x]] is InvMixColumns applied to a single byte x.
+                round_words = [Td0[s_box[w >> 24]] ^ Td1[s_box[(w >> 16) & 0xFF]] ^
+                               Td2[s_box[(w >> 8) & 0xFF]] ^ Td3[s_box[w & 0xFF]]
+                               for w in round_words]
+            decrypt_words.extend(round_words)
+
+        return decrypt_words
+
+    @cached_property
+    def _decrypt_key_matrices(self):
+        """ Round keys of the equivalent inverse cipher, in the order used. """
+        return [[list(w.to_bytes(4, 'big')) for w in self._decrypt_words[i:i+4]]
+                for i in range(0, len(self._decrypt_words), 4)]
+
+    @cached_property
+    def _decrypt_round_keys(self):
+        """ `_decrypt_key_matrices` as flat bytearrays, for the 'flat' engine. """
+        return [bytearray(b for column in matrix for b in column)
+                for matrix in self._decrypt_key_matrices]
+
+    @cached_property
+    def _key_array(self):
+        """ The round keys as an (R+1, 16) uint8 array, for the batch API. """
+        return np.array([[b for column in matrix for b in column]
+                         for matrix in self._key_matrices], dtype=np.uint8)
+
+    def _encrypt_columns(self, s0, s1, s2, s3):
+        """
+        Encrypts a state given as four 32-bit column words using T-tables,
+        returning the four output words.
+        """
+        rk = self._encrypt_words
+        s0, s1, s2, s3 = s0 ^ rk[0], s1 ^ rk[1], s2 ^ rk[2], s3 ^ rk[3]
+
+        for i in range(4, 4 * self.n_rounds, 4):
+            s0, s1, s2, s3 = (
+                Te0[s0 >> 24] ^ Te1[(s1 >> 16) & 0xFF] ^ Te2[(s2 >> 8) & 0xFF] ^ Te3[s3 & 0xFF] ^ rk[i],
+                Te0[s1 >> 24] ^ Te1[(s2 >> 16) & 0xFF] ^ Te2[(s3 >> 8) & 0xFF] ^ Te3[s0 & 0xFF] ^ rk[i+1],
+                Te0[s2 >> 24] ^ Te1[(s3 >> 16) & 0xFF] ^ Te2[(s0 >> 8) & 0xFF] ^ Te3[s1 & 0xFF] ^ rk[i+2],
+                Te0[s3 >> 24] ^ Te1[(s0 >> 16) & 0xFF] ^ Te2[(s1 >> 8) & 0xFF] ^ Te3[s2 & 0xFF] ^ rk[i+3],
+            )
+
+        # Last round has no MixColumns, so only the S-box is applied.
+        i = 4 * self.n_rounds
+        return (
+            (s_box[s0 >> 24] << 24 | s_box[(s1 >> 16) & 0xFF] << 16 | s_box[(s2 >> 8) & 0xFF] << 8 | s_box[s3 & 0xFF]) ^ rk[i],
+            (s_box[s1 >> 24] << 24 | s_box[(s2 >> 16) & 0xFF] << 16 | s_box[(s3 >> 8) & 0xFF] << 8 | s_box[s0 & 0xFF]) ^ rk[i+1],
+            (s_box[s2 >> 24] << 24 | s_box[(s3 >> 16) & 0xFF] << 16 | s_box[(s0 >> 8) & 0xFF] << 8 | s_box[s1 & 0xFF]) ^ rk[i+2],
+            (s_box[s3 >> 24] << 24 | s_box[(s0 >> 16) & 0xFF] << 16 | s_box[(s1 >> 8) & 0xFF] << 8 | s_box[s2 & 0xFF]) ^ rk[i+3],
+        )
+
+    def _decrypt_columns(self, s0, s1, s2, s3):
+        """
+        Decrypts a state given as four 32-bit column words using T-tables,
+        returning the four output words.
+        """
+        rk = self._decrypt_words
+        s0, s1, s2, s3 = s0 ^ rk[0], s1 ^ rk[1], s2 ^ rk[2], s3 ^ rk[3]
+
+        for i in range(4, 4 * self.n_rounds, 4):
+            s0, s1, s2, s3 = (
+                Td0[s0 >> 24] ^ Td1[(s3 >> 16) & 0xFF] ^ Td2[(s2 >> 8) & 0xFF] ^ Td3[s1 & 0xFF] ^ rk[i],
+                Td0[s1 >> 24] ^ Td1[(s0 >> 16) & 0xFF] ^ Td2[(s3 >> 8) & 0xFF] ^ Td3[s2 & 0xFF] ^ rk[i+1],
+                Td0[s2 >> 24] ^ Td1[(s1 >> 16) & 0xFF] ^ Td2[(s0 >> 8) & 0xFF] ^ Td3[s3 & 0xFF] ^ rk[i+2],
+                Td0[s3 >> 24] ^ Td1[(s2 >> 16) & 0xFF] ^ Td2[(s1 >> 8) & 0xFF] ^ Td3[s0 & 0xFF] ^ rk[i+3],
+            )
+
+        i = 4 * self.n_rounds
+        return (
+            (inv_s_box[s0 >> 24] << 24 | inv_s_box[(s3 >> 16) & 0xFF] << 16 | inv_s_box[(s2 >> 8) & 0xFF] << 8 | inv_s_box[s1 & 0xFF]) ^ rk[i],
+            (inv_s_box[s1 >> 24] << 24 | inv_s_box[(s0 >> 16) & 0xFF] << 16 | inv_s_box[(s3 >> 8) & 0xFF] << 8 | inv_s_box[s2 & 0xFF]) ^ rk[i+1],
+            (inv_s_box[s2 >> 24] << 24 | inv_s_box[(s1 >> 16) & 0xFF] << 16 | inv_s_box[(s0 >> 8) & 0xFF] << 8 | inv_s_box[s3 & 0xFF]) ^ rk[i+2],
+            (inv_s_box[s3 >> 24] << 24 | inv_s_box[(s2 >> 16) & 0xFF] << 16 | inv_s_box[(s1 >> 8) & 0xFF] << 8 | inv_s_box[s0 & 0xFF]) ^ rk[i+3],
+        )
+
+    def _encrypt_block_table(self, plaintext):
+        """
+        Encrypts a single block of 16 byte long plaintext using T-tables.
+        """
+        assert len(plaintext) == 16
+        return pack('>4I', *self._encrypt_columns(*unpack('>4I', plaintext)))
+
+    def _decrypt_block_table(self, ciphertext):
+        """
+        Decrypts a single block of 16 byte long ciphertext using T-tables.
+        """
+        assert len(ciphertext) == 16
+        return pack('>4I', *self._decrypt_columns(*unpack('>4I', ciphertext)))
+
+    def _bitsliced(self, data, decrypt):
+        """
+        Encrypts or decrypts whole blocks with the bitsliced engine,
+        `batch_size` blocks per pass.
+        """
+        out = []
+        for start in range(0, len(data), 16 * self.batch_size):
+            chunk = data[start:start + 16 * self.batch_size]
+            bits = len(chunk)
+            # Round keys are 16 bit patterns, repeated once per block.
+            repeat = ((1 << bits) - 1) // 0xFFFF
+            ones = (1 << bits) - 1
+            keys = [[k * repeat for k in planes] for planes in self._key_planes]
+            planes = pack_bitsliced(chunk)
+            if decrypt:
+                planes = self._decrypt_planes(planes, keys, repeat, ones)
+            else:
+                planes = self._encrypt_planes(planes, keys, repeat, ones)
+            out.append(unpack_bitsliced(planes, bits))
+        return b''.join(out)
+
+    def _encrypt_planes(self, planes, keys, repeat, ones):
+        planes = [p ^ k for p, k in zip(planes, keys[0])]
+        for i in range(1, self.n_rounds):
+            planes = _permute_planes(sub_bytes_bitsliced(planes, ones), _shift_rows_shifts, repeat)
+            planes = mix_columns_bitsliced(planes, repeat)
+            planes = [p ^ k for p, k in zip(planes, keys[i])]
+        planes = _permute_planes(sub_bytes_bitsliced(planes, ones), _shift_rows_shifts, repeat)
+        return [p ^ k for p, k in zip(planes, keys[-1])]
+
+    def _decrypt_planes(self, planes, keys, repeat, ones):
+        planes = [p ^ k for p, k in zip(planes, keys[-1])]
+        planes = inv_sub_bytes_bitsliced(_permute_planes(planes, _inv_shift_rows_shifts, repeat), ones)
+        for i in range(self.n_rounds - 1, 0, -1):
+            planes = [p ^ k for p, k in zip(planes, keys[i])]
+            planes = inv_mix_columns_bitsliced(planes, repeat)
+            planes = inv_sub_bytes_bitsliced(_permute_planes(planes, _inv_shift_rows_shifts, repeat), ones)
+        return [p ^ k for p, k in zip(planes, keys[0])]
+
+    def _encrypt_block_bitsliced(self, plaintext):
+        """
+        Encrypts a single block of 16 byte long plaintext with the bitsliced
+        engine.
+        """
+        assert len(plaintext) == 16
+        return self._bitsliced(bytes(plaintext), decrypt=False)
+
+    def _decrypt_block_bitsliced(self, ciphertext):
+        """
+        Decrypts a single block of 16 byte long ciphertext with the bitsliced
+        engine.
+        """
+        assert len(ciphertext) == 16
+        return self._bitsliced(bytes(ciphertext), decrypt=True)
+
+    def _encrypt_state_flat(self, state):
+        """
+        Encrypts the 16 byte bytearray `state` in place with the flat engine.
+        """
+        keys = self._round_keys
+        add_round_key_flat(state, keys[0])
+
+        for i in range(1, self.n_rounds):
+            sub_bytes_flat(state)
+            shift_rows_flat(state)
+            mix_columns_flat(state)
+            add_round_key_flat(state, keys[i])
+
+        sub_bytes_flat(state)
+        shift_rows_flat(state)
+        add_round_key_flat(state, keys[-1])
+
+    def _decrypt_state_flat(self, state):
+        """
+        Decrypts the 16 byte bytearray `state` in place with the flat engine.
+        """
+        keys = self._decrypt_round_keys
+        add_round_key_flat(state, keys[0])
+
+        for i in range(1, self.n_rounds):
+            inv_shift_rows_flat(state)
+            inv_sub_mix_columns_flat(state)
+            add_round_key_flat(state, keys[i])
+
+        inv_shift_rows_flat(state)
+        inv_sub_bytes_flat(state)
+        add_round_key_flat(state, keys[-1])
+
+    def _encrypt_block_flat(self, plaintext):
+        assert len(plaintext) == 16
+        state = bytearray(plaintext)
+        self._encrypt_state_flat(state)
+        return bytes(state)
+
+    def _decrypt_block_flat(self, ciphertext):
+        assert len(ciphertext) == 16
+        state = bytearray(ciphertext)
+        self._decrypt_state_flat(state)
+        return bytes(state)
+
+    def encrypt_state(self, state):
+        """
+        Encrypts the 16 byte bytearray `state` in place. Only the 'flat'
+        engine does so without building bytes or lists, the others go through
+        `encrypt_block`.
+        """
+        state[:] = self.encrypt_block(state)
+
+    def decrypt_state(self, state):
+        """
+        Decrypts the 16 byte bytearray `state` in place, see `encrypt_state`.
+        """
+        state[:] = self.decrypt_block(state)
+
     def encrypt_block(self, plaintext):
         """
         Encrypts a single block of 16 byte long plaintext.
@@ -248,25 +929,98 @@ class AES:
     def decrypt_block(self, ciphertext):
         """
         Decrypts a single block of 16 byte long ciphertext.
+
+        Uses the equivalent inverse cipher (Sec 5.3.5 of FIPS-197): the steps
+        run in the same order as encryption, so InvSubBytes and InvMixColumns
+        merge into Td lookups, with InvMixColumns already applied to the
+        inner round keys at key setup.
         """
         assert len(ciphertext) == 16
 
         cipher_state = bytes2matrix(ciphertext)
+        keys = self._decrypt_key_matrices
 
-        add_round_key(cipher_state, self._key_matrices[-1])
-        inv_shift_rows(cipher_state)
-        inv_sub_bytes(cipher_state)
+        add_round_key(cipher_state, keys[0])
 
-        for i in range(self.n_rounds - 1, 0, -1):
-            add_round_key(cipher_state, self._key_matrices[i])
-            inv_mix_columns(cipher_state)
+        for i in range(1, self.n_rounds):
             inv_shift_rows(cipher_state)
-            inv_sub_bytes(cipher_state)
+            inv_sub_mix_columns(cipher_state)
+            add_round_key(cipher_state, keys[i])
 
-        add_round_key(cipher_state, self._key_matrices[0])
+        inv_shift_rows(cipher_state)
+        inv_sub_bytes(cipher_state)
+        add_round_key(cipher_state, keys[-1])
 
         return matrix2bytes(cipher_state)
 
+    # Number of blocks processed per vectorized pass, so the working set of
+    # the batch engine stays in cache.
+    batch_size = 4096
+
+    def _encrypt_array(self, states):
+        """
+        Encrypts an (N, 16) uint8 array of states, returning a new array.
+        """
+        out = np.empty_like(states)
+        for start in range(0, len(states), self.batch_size):
+            out[start:start + self.batch_size] = encrypt_array(states[start:start + self.batch_size], self._key_array)
+        return out
+
+    def _decrypt_array(self, states):
+        """
+        Decrypts an (N, 16) uint8 array of states, returning a new array.
+        """
+        out = np.empty_like(states)
+        for start in range(0, len(states), self.batch_size):
+            out[start:start + self.batch_size] = decrypt_array(states[start:start + self.batch_size], self._key_array)
+        return out
+
+    def encrypt_blocks(self, blocks):
+        """
+        Encrypts many independent 16 byte blocks at once (ECB, no padding).
+
+        `blocks` is either a bytes-like object whose length is a multiple of
+        16, or an (N, 16) uint8 NumPy array; the result has the same type.
+        With the bitsliced engine or NumPy all N states go through each round
+        step together, otherwise this falls back to `encrypt_block` one block
+        at a time.
+        """
+        if np is not None and isinstance(blocks, np.ndarray):
+            assert blocks.ndim == 2 and blocks.shape[1] == 16
+            if self.engine == 'bitslice':
+                data = self._bitsliced(blocks.astype(np.uint8).tobytes(), decrypt=False)
+                return np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)
+            return self._encrypt_array(blocks.astype(np.uint8, copy=False))
+
+        assert len(blocks) % 16 == 0
+        if self.engine == 'bitslice':
+            return self._bitsliced(bytes(blocks), decrypt=False)
+        if np is None:
+            return b''.join(map(self.encrypt_block, split_blocks(bytes(blocks))))
+        states = np.frombuffer(blocks, dtype=np.uint8).reshape(-1, 16)
+        return self._encrypt_array(states).tobytes()
+
+    def decrypt_blocks(self, blocks):
+        """
+        Decrypts many independent 16 byte blocks at once (ECB, no padding).
+
+        Accepts and returns the same types as `encrypt_blocks`.
+        """
+        if np is not None and isinstance(blocks, np.ndarray):
+            assert blocks.ndim == 2 and blocks.shape[1] == 16
+            if self.engine == 'bitslice':
+                data = self._bitsliced(blocks.astype(np.uint8).tobytes(), decrypt=True)
+                return np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)
+            return self._decrypt_array(blocks.astype(np.uint8, copy=False))
+
+        assert len(blocks) % 16 == 0
+        if self.engine == 'bitslice':
+            return self._bitsliced(bytes(blocks), decrypt=True)
+        if np is None:
+            return b''.join(map(self.decrypt_block, split_blocks(bytes(blocks))))
+        states = np.frombuffer(blocks, dtype=np.uint8).reshape(-1, 16)
+        return self._decrypt_array(states).tobytes()
+
     def encrypt_cbc(self, plaintext, iv):
         """
         Encrypts `plaintext` using CBC mode and PKCS#7 padding, with the given
@@ -276,15 +1030,15 @@ class AES:
 
         plaintext = pad(plaintext)
 
-        blocks = []
-        previous = iv
-        for plaintext_block in split_blocks(plaintext):
+        out = bytearray(len(plaintext))
+        state = bytearray(iv)
+        for offset in range(0, len(plaintext), 16):
             # CBC mode encrypt: encrypt(plaintext_block XOR previous)
-            block = self.encrypt_block(xor_bytes(plaintext_block, previous))
-            blocks.append(block)
-            previous = block
+            xor_into(state, 0, plaintext, offset)
+            self.encrypt_state(state)
+            out[offset:offset+16] = state
 
-        return b''.join(blocks)
+        return bytes(out)
 
     def decrypt_cbc(self, ciphertext, iv):
         """
@@ -292,15 +1046,23 @@ class AES:
         initialization vector (iv).
         """
         assert len(iv) == 16
-
-        blocks = []
-        previous = iv
-        for ciphertext_block in split_blocks(ciphertext):
-            # CBC mode decrypt: previous XOR decrypt(ciphertext)
-            blocks.append(xor_bytes(previous, self.decrypt_block(ciphertext_block)))
-            previous = ciphertext_block
-
-        return unpad(b''.join(blocks))
+        assert len(ciphertext) % 16 == 0
+
+        out = bytearray(len(ciphertext))
+        state = bytearray(16)
+        # Blocks are copied into `state` through a view, without slicing out bytes.
+        with memoryview(ciphertext) as view:
+            for offset in range(0, len(ciphertext), 16):
+                # CBC mode decrypt: previous XOR decrypt(ciphertext)
+                state[:] = view[offset:offset+16]
+                self.decrypt_state(state)
+                if offset:
+                    xor_into(state, 0, ciphertext, offset - 16)
+                else:
+                    xor_into(state, 0, iv)
+                out[offset:offset+16] = state
+
+        return unpad(bytes(out))
 
     def encrypt_pcbc(self, plaintext, iv):
         """
@@ -311,17 +1073,17 @@ class AES:
 
         plaintext = pad(plaintext)
 
-        blocks = []
-        prev_ciphertext = iv
-        prev_plaintext = bytes(16)
-        for plaintext_block in split_blocks(plaintext):
+        out = bytearray(len(plaintext))
+        # Holds prev_ciphertext XOR prev_plaintext between blocks.
+        state = bytearray(iv)
+        for offset in range(0, len(plaintext), 16):
             # PCBC mode encrypt: encrypt(plaintext_block XOR (prev_ciphertext XOR prev_plaintext))
-            ciphertext_block = self.encrypt_block(xor_bytes(plaintext_block, xor_bytes(prev_ciphertext, prev_plaintext)))
-            blocks.append(ciphertext_block)
-            prev_ciphertext = ciphertext_block
-            prev_plaintext = plaintext_block
+            xor_into(state, 0, plaintext, offset)
+            self.encrypt_state(state)
+            out[offset:offset+16] = state
+            xor_into(state, 0, plaintext, offset)
 
-        return b''.join(blocks)
+        return bytes(out)
 
     def decrypt_pcbc(self, ciphertext, iv):
         """
@@ -329,18 +1091,23 @@ class AES:
         initialization vector (iv).
         """
         assert len(iv) == 16
-
-        blocks = []
-        prev_ciphertext = iv
-        prev_plaintext = bytes(16)
-        for ciphertext_block in split_blocks(ciphertext):
-            # PCBC mode decrypt: (prev_plaintext XOR prev_ciphertext) XOR decrypt(ciphertext_block)
-            plaintext_block = xor_bytes(xor_bytes(prev_ciphertext, prev_plaintext), self.decrypt_block(ciphertext_block))
-            blocks.append(plaintext_block)
-            prev_ciphertext = ciphertext_block
-            prev_plaintext = plaintext_block
-
-        return unpad(b''.join(blocks))
+        assert len(ciphertext) % 16 == 0
+
+        out = bytearray(len(ciphertext))
+        state = bytearray(16)
+        # Holds prev_ciphertext XOR prev_plaintext between blocks.
+        chain = bytearray(iv)
+        with memoryview(ciphertext) as view:
+            for offset in range(0, len(ciphertext), 16):
+                # PCBC mode decrypt: (prev_plaintext XOR prev_ciphertext) XOR decrypt(ciphertext_block)
+                state[:] = view[offset:offset+16]
+                self.decrypt_state(state)
+                xor_into(state, 0, chain)
+                out[offset:offset+16] = state
+                chain[:] = state
+                xor_into(chain, 0, ciphertext, offset)
+
+        return unpad(bytes(out))
 
     def encrypt_cfb(self, plaintext, iv):
         """
@@ -351,15 +1118,15 @@ class AES:
 
         plaintext = pad(plaintext)
 
-        blocks = []
-        prev_ciphertext = iv
-        for plaintext_block in split_blocks(plaintext):
+        out = bytearray(len(plaintext))
+        state = bytearray(iv)
+        for offset in range(0, len(plaintext), 16):
             # CFB mode encrypt: plaintext_block XOR encrypt(prev_ciphertext)
-            ciphertext_block = xor_bytes(plaintext_block, self.encrypt_block(prev_ciphertext))
-            blocks.append(ciphertext_block)
-            prev_ciphertext = ciphertext_block
+            self.encrypt_state(state)
+            xor_into(state, 0, plaintext, offset)
+            out[offset:offset+16] = state
 
-        return b''.join(blocks)
+        return bytes(out)
 
     def decrypt_cfb(self, ciphertext, iv):
         """
@@ -367,16 +1134,19 @@ class AES:
         initialization vector (iv).
         """
         assert len(iv) == 16
+        assert len(ciphertext) % 16 == 0
 
-        blocks = []
-        prev_ciphertext = iv
-        for ciphertext_block in split_blocks(ciphertext):
-            # CFB mode decrypt: ciphertext XOR decrypt(prev_ciphertext)
-            plaintext_block = xor_bytes(ciphertext_block, self.decrypt_block(prev_ciphertext))
-            blocks.append(plaintext_block)
-            prev_ciphertext = ciphertext
+        out = bytearray(len(ciphertext))
+        step = 16 * self.batch_size
+        previous = iv
+        for start in range(0, len(ciphertext), step):
+            chunk = ciphertext[start:start + step]
+            # CFB mode decrypt: ciphertext XOR encrypt(prev_ciphertext)
+            keystream = self.encrypt_blocks(previous + chunk[:-16])
+            out[start:start + len(chunk)] = xor_span(chunk, keystream)
+            previous = chunk[-16:]
 
-        return unpad(b''.join(blocks))
+        return unpad(bytes(out))
 
     def encrypt_ofb(self, plaintext, iv):
         """
@@ -385,18 +1155,7 @@ class AES:
         """
         assert len(iv) == 16
 
-        plaintext = pad(plaintext)
-
-        blocks = []
-        previous = iv
-        for plaintext_block in split_blocks(plaintext):
-            # OFB mode encrypt: plaintext_block XOR encrypt(previous)
-            block = self.encrypt_block(previous)
-            ciphertext_block = xor_bytes(plaintext_block, block)
-            blocks.append(ciphertext_block)
-            previous = block
-
-        return b''.join(blocks)
+        return self._ofb(pad(plaintext), iv)
 
     def decrypt_ofb(self, ciphertext, iv):
         """
@@ -404,17 +1163,25 @@ class AES:
         initialization vector (iv).
         """
         assert len(iv) == 16
-
-        blocks = []
-        previous = iv
-        for ciphertext_block in split_blocks(ciphertext):
-            # OFB mode decrypt: ciphertext XOR decrypt(previous)
-            block = self.decrypt_block(previous)
-            plaintext_block = xor_bytes(ciphertext_block, block)
-            blocks.append(plaintext_block)
-            previous = block
-
-        return unpad(b''.join(blocks))
+        assert len(ciphertext) % 16 == 0
+
+        return unpad(self._ofb(ciphertext, iv))
+
+    def _ofb(self, data, iv):
+        # Each keystream block depends on the previous one, so the blocks are
+        # produced one at a time into a chunk buffer, then XORed in bulk.
+        out = bytearray(len(data))
+        step = 16 * self.batch_size
+        keystream = bytearray(min(step, len(data)))
+        state = bytearray(iv)
+        for start in range(0, len(data), step):
+            chunk = data[start:start + step]
+            for offset in range(0, len(chunk), 16):
+                # OFB mode: data_block XOR encrypt(previous), in both directions
+                self.encrypt_state(state)
+                keystream[offset:offset+16] = state
+            out[start:start + len(chunk)] = xor_span(chunk, keystream[:len(chunk)])
+        return bytes(out)
 
     def encrypt_ctr(self, plaintext, iv):
         """
@@ -423,39 +1190,516 @@ class AES:
         """
         assert len(iv) == 16
 
-        plaintext = pad(plaintext)
+        return self._ctr(pad(plaintext), iv)
 
-        blocks = []
-        nonce = iv
-        for plaintext_block in split_blocks(plaintext):
-            # CTR mode encrypt: plaintext_block XOR encrypt(nonce)
-            block = xor_bytes(plaintext_block, self.encrypt_block(nonce))
-            blocks.append(block)
-            nonce = inc_bytes(nonce)
+    def decrypt_ctr(self, ciphertext, iv):
+        """
+        Decrypts `plaintext` using CTR mode and PKCS#7 padding, with the given
+        initialization vector (iv).
+        """
+        assert len(iv) == 16
+        assert len(ciphertext) % 16 == 0
+
+        return unpad(self._ctr(ciphertext, iv))
+
+    def _ctr(self, data, iv):
+        out = bytearray(len(data))
+        step = 16 * self.batch_size
+        counter = int.from_bytes(iv, 'big')
+        for start in range(0, len(data), step):
+            chunk = data[start:start + step]
+            # CTR mode: data_block XOR encrypt(nonce), in both directions
+            keystream = ctr_keystream(self, counter, len(chunk) // 16)
+            out[start:start + len(chunk)] = xor_span(chunk, keystream)
+            counter += len(chunk) // 16
+        return bytes(out)
+
+    def encrypt_ctr_parallel(self, plaintext, iv, workers=None, chunk_size=1 << 20, executor=None):
+        """
+        Encrypts `plaintext` using CTR mode and PKCS#7 padding, with the given
+        initialization vector (iv), computing the keystream in a process pool.
 
-        return b''.join(blocks)
+        The message is split in `chunk_size` byte counter ranges which are
+        encrypted by up to `workers` processes (default: one per CPU), or by
+        `executor` if one is given so a pool can be reused between calls.
+        The output is identical to `encrypt_ctr`.
+        """
+        assert len(iv) == 16
 
-    def decrypt_ctr(self, ciphertext, iv):
+        return self._ctr_parallel(pad(plaintext), iv, workers, chunk_size, executor)
+
+    def decrypt_ctr_parallel(self, ciphertext, iv, workers=None, chunk_size=1 << 20, executor=None):
         """
         Decrypts `plaintext` using CTR mode and PKCS#7 padding, with the given
+        initialization vector (iv), computing the keystream in a process pool.
+
+        See `encrypt_ctr_parallel` for the parameters.
+        """
+        assert len(iv) == 16
+        assert len(ciphertext) % 16 == 0
+
+        return unpad(self._ctr_parallel(ciphertext, iv, workers, chunk_size, executor))
+
+    def _ctr_parallel(self, data, iv, workers, chunk_size, executor):
+        """
+        XORs `data` with the CTR keystream for `iv`, one counter range per task.
+        """
+        assert chunk_size > 0 and chunk_size % 16 == 0
+        chunk_blocks = chunk_size // 16
+        n_blocks = len(data) // 16
+        counter = int.from_bytes(iv, 'big')
+        starts = range(0, n_blocks, chunk_blocks)
+        counters = [counter + start for start in starts]
+        counts = [min(chunk_blocks, n_blocks - start) for start in starts]
+
+        keystreams = self._pool_map(ctr_keystream, workers, executor, counters, counts)
+
+        out = bytearray(len(data))
+        for start, keystream in zip(starts, keystreams):
+            begin, end = start * 16, start * 16 + len(keystream)
+            out[begin:end] = xor_span(data[begin:end], keystream)
+        return bytes(out)
+
+    def _pool_map(self, function, workers, executor, *columns):
+        """
+        Returns the results of `function(self, *args)` for each row of
+        `columns`, in order. Runs in `executor` if given, else in a new pool
+        of `workers` processes, or in this process when there is a single
+        task or `workers` is 1.
+        """
+        if executor is not None:
+            return executor.map(function, repeat(self), *columns)
+        elif workers == 1 or len(columns[0]) <= 1:
+            return map(function, repeat(self), *columns)
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                return list(pool.map(function, repeat(self), *columns))
+
+    def _blocks_parallel(self, method, data, workers, chunk_size, executor):
+        """
+        Runs the batch `method` ('encrypt_blocks' or 'decrypt_blocks') over
+        `data` in `chunk_size` byte pieces, see `_pool_map`.
+        """
+        assert chunk_size > 0 and chunk_size % 16 == 0
+        chunks = [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
+        return b''.join(self._pool_map(run_blocks, workers, executor, [method] * len(chunks), chunks))
+
+    def decrypt_cbc_parallel(self, ciphertext, iv, workers=None, chunk_size=1 << 20, executor=None):
+        """
+        Decrypts `plaintext` using CBC mode and PKCS#7 padding, with the given
         initialization vector (iv).
+
+        Every block's inputs are known up front, so all blocks are decrypted
+        in one batched pass (split across processes like
+        `encrypt_ctr_parallel`) and XORed with the shifted ciphertext at once.
         """
         assert len(iv) == 16
+        assert len(ciphertext) % 16 == 0
 
-        blocks = []
-        nonce = iv
-        for ciphertext_block in split_blocks(ciphertext):
-            # CTR mode decrypt: ciphertext XOR decrypt(nonce)
-            block = xor_bytes(ciphertext_block, self.decrypt_block(nonce))
-            blocks.append(block)
-            nonce = inc_bytes(nonce)
+        decrypted = self._blocks_parallel('decrypt_blocks', ciphertext, workers, chunk_size, executor)
+        # CBC mode decrypt: previous XOR decrypt(ciphertext)
+        return unpad(xor_span(decrypted, iv + ciphertext[:-16]))
+
+    def decrypt_cfb_parallel(self, ciphertext, iv, workers=None, chunk_size=1 << 20, executor=None):
+        """
+        Decrypts `plaintext` using CFB mode and PKCS#7 padding, with the given
+        initialization vector (iv), in one batched pass.
+
+        See `decrypt_cbc_parallel` for the parameters.
+        """
+        assert len(iv) == 16
+        assert len(ciphertext) % 16 == 0
+
+        previous = iv + ciphertext[:-16]
+        keystream = self._blocks_parallel('encrypt_blocks', previous, workers, chunk_size, executor)
+        # CFB mode decrypt: ciphertext XOR encrypt(prev_ciphertext)
+        return unpad(xor_span(ciphertext, keystream))
+
+    def decrypt_pcbc_parallel(self, ciphertext, iv, workers=None, chunk_size=1 << 20, executor=None):
+        """
+        Decrypts `plaintext` using PCBC mode and PKCS#7 padding, with the given
+        initialization vector (iv).
+
+        The block decryptions are batched like `decrypt_cbc_parallel`; only
+        the final running XOR over the plaintext blocks stays serial.
+        """
+        assert len(iv) == 16
+        assert len(ciphertext) % 16 == 0
 
+        decrypted = self._blocks_parallel('decrypt_blocks', ciphertext, workers, chunk_size, executor)
+        # PCBC mode decrypt: (prev_plaintext XOR prev_ciphertext) XOR decrypt(ciphertext_block),
+        # so each plaintext block is the running XOR of (prev_ciphertext XOR decrypt(ciphertext_block)).
+        mixed = xor_span(decrypted, iv + ciphertext[:-16])
+        if np is not None:
+            states = np.frombuffer(mixed, dtype=np.uint8).reshape(-1, 16)
+            return unpad(np.bitwise_xor.accumulate(states, axis=0).tobytes())
+
+        blocks = []
+        previous = 0
+        for block in split_blocks(mixed):
+            previous ^= int.from_bytes(block, 'big')
+            blocks.append(previous.to_bytes(16, 'big'))
         return unpad(b''.join(blocks))
 
+    into_modes = ('cbc', 'pcbc', 'cfb', 'ofb', 'ctr')
+
+    def _column_function(self, decrypt):
+        """
+        Returns the function `encrypt_into` and `decrypt_into` run on a block
+        given as four 32-bit column words. The other engines index tables
+        with secret data too, so they share the faster T-table round; the
+        'bitslice' engine goes through its own `encrypt_block` and
+        `decrypt_block`, keeping them constant time.
+        """
+        if self.engine != 'bitslice':
+            return self._decrypt_columns if decrypt else self._encrypt_columns
+        block = self.decrypt_block if decrypt else self.encrypt_block
+        return lambda *words: unpack('>4I', block(pack('>4I', *words)))
+
+    def encrypt_into(self, mode, source, destination, iv):
+        """
+        Encrypts `source` into the preallocated `destination` using `mode`
+        (one of `AES.into_modes`) without padding, with the given
+        initialization vector (iv).
+
+        Both are buffers of the same length, a multiple of 16: bytes,
+        bytearray, mmap or memoryview. Blocks are read and written in place
+        with struct and the T-table round on column words, so no bytes
+        objects or lists are built per block. `destination` may be `source`.
+        The 'bitslice' engine keeps its own rounds instead, without
+        secret-dependent lookups but with a bytes object per block, see
+        `_column_function`.
+
+        Returns the chaining value to pass as `iv` to encrypt the data that
+        follows, so large inputs can be processed in several calls.
+        """
+        assert mode in AES.into_modes, 'Unknown mode %r.' % (mode,)
+        assert len(iv) == 16
+        assert len(source) % 16 == 0 and len(destination) == len(source)
+
+        encrypt = self._column_function(decrypt=False)
+        c0, c1, c2, c3 = unpack('>4I', iv)
+        counter = int.from_bytes(iv, 'big')
+        for offset in range(0, len(source), 16):
+            p0, p1, p2, p3 = unpack_from('>4I', source, offset)
+            if mode == 'cbc':
+                # CBC mode encrypt: encrypt(plaintext_block XOR previous)
+                c0, c1, c2, c3 = encrypt(p0 ^ c0, p1 ^ c1, p2 ^ c2, p3 ^ c3)
+                pack_into('>4I', destination, offset, c0, c1, c2, c3)
+            elif mode == 'pcbc':
+                # PCBC chains on prev_ciphertext XOR prev_plaintext.
+                k0, k1, k2, k3 = encrypt(p0 ^ c0, p1 ^ c1, p2 ^ c2, p3 ^ c3)
+                pack_into('>4I', destination, offset, k0, k1, k2, k3)
+                c0, c1, c2, c3 = k0 ^ p0, k1 ^ p1, k2 ^ p2, k3 ^ p3
+            elif mode == 'cfb':
+                # CFB mode encrypt: plaintext_block XOR encrypt(prev_ciphertext)
+                k0, k1, k2, k3 = encrypt(c0, c1, c2, c3)
+                c0, c1, c2, c3 = p0 ^ k0, p1 ^ k1, p2 ^ k2, p3 ^ k3
+                pack_into('>4I', destination, offset, c0, c1, c2, c3)
+            elif mode == 'ofb':
+                # OFB mode encrypt: plaintext_block XOR encrypt(previous)
+                c0, c1, c2, c3 = encrypt(c0, c1, c2, c3)
+                pack_into('>4I', destination, offset, p0 ^ c0, p1 ^ c1, p2 ^ c2, p3 ^ c3)
+            else:
+                # CTR mode encrypt: plaintext_block XOR encrypt(nonce)
+                k0, k1, k2, k3 = encrypt(counter >> 96, (counter >> 64) & 0xFFFFFFFF,
+                                         (counter >> 32) & 0xFFFFFFFF, counter & 0xFFFFFFFF)
+                pack_into('>4I', destination, offset, p0 ^ k0, p1 ^ k1, p2 ^ k2, p3 ^ k3)
+                counter = (counter + 1) & ((1 << 128) - 1)
+
+        if mode == 'ctr':
+            return counter.to_bytes(16, 'big')
+        return pack('>4I', c0, c1, c2, c3)
+
+    def decrypt_into(self, mode, source, destination, iv):
+        """
+        Decrypts `source` into the preallocated `destination` using `mode`,
+        without removing padding. The counterpart of `encrypt_into`, with the
+        same arguments and return value.
+        """
+        assert mode in AES.into_modes, 'Unknown mode %r.' % (mode,)
+        assert len(iv) == 16
+        assert len(source) % 16 == 0 and len(destination) == len(source)
+
+        if mode in ('ofb', 'ctr'):
+            # The keystream only depends on the iv, decryption is encryption.
+            return self.encrypt_into(mode, source, destination, iv)
+
+        encrypt = self._column_function(decrypt=False)
+        decrypt = self._column_function(decrypt=True)
+        c0, c1, c2, c3 = unpack('>4I', iv)
+        for offset in range(0, len(source), 16):
+            k0, k1, k2, k3 = unpack_from('>4I', source, offset)
+            if mode == 'cbc':
+                # CBC mode decrypt: previous XOR decrypt(ciphertext)
+                p0, p1, p2, p3 = decrypt(k0, k1, k2, k3)
+                pack_into('>4I', destination, offset, p0 ^ c0, p1 ^ c1, p2 ^ c2, p3 ^ c3)
+                c0, c1, c2, c3 = k0, k1, k2, k3
+            elif mode == 'pcbc':
+                # PCBC chains on prev_ciphertext XOR prev_plaintext.
+                p0, p1, p2, p3 = decrypt(k0, k1, k2, k3)
+                p0, p1, p2, p3 = p0 ^ c0, p1 ^ c1, p2 ^ c2, p3 ^ c3
+                pack_into('>4I', destination, offset, p0, p1, p2, p3)
+                c0, c1, c2, c3 = k0 ^ p0, k1 ^ p1, k2 ^ p2, k3 ^ p3
+            else:
+                # CFB mode decrypt: ciphertext XOR encrypt(prev_ciphertext)
+                p0, p1, p2, p3 = encrypt(c0, c1, c2, c3)
+                pack_into('>4I', destination, offset, k0 ^ p0, k1 ^ p1, k2 ^ p2, k3 ^ p3)
+                c0, c1, c2, c3 = k0, k1, k2, k3
+
+        return pack('>4I', c0, c1, c2, c3)
+
+    def _gcm_counter0(self, iv):
+        """
+        Returns the GCM hash table for this key and the pre-counter block J0
+        for `iv`, as an integer.
+        """
+        if not hasattr(self, '_gcm_table'):
+            self._gcm_table = gcm_multiplication_table(int.from_bytes(self.encrypt_block(bytes(16)), 'big'))
+
+        if len(iv) == 12:
+            return self._gcm_table, int.from_bytes(iv + b'\x00\x00\x00\x01', 'big')
+        length_block = (len(iv) * 8).to_bytes(16, 'big')
+        return self._gcm_table, ghash(self._gcm_table, iv + bytes(-len(iv) % 16) + length_block)
+
+    def _gcm_ctr(self, data, counter0):
+        """
+        XORs `data` with the GCM keystream, which starts at inc32(J0) and only
+        increments the low 32 bits of the counter.
+        """
+        n_blocks = (len(data) + 15) // 16
+        prefix = counter0 >> 32 << 32
+        counters = b''.join((prefix | ((counter0 + i) & 0xFFFFFFFF)).to_bytes(16, 'big')
+                            for i in range(1, n_blocks + 1))
+        keystream = self.encrypt_blocks(counters)
+        return xor_span(data, keystream[:len(data)])
+
+    def _gcm_tag(self, table, counter0, associated_data, ciphertext):
+        lengths = (len(associated_data) * 8).to_bytes(8, 'big') + (len(ciphertext) * 8).to_bytes(8, 'big')
+        s = ghash(table, associated_data + bytes(-len(associated_data) % 16) +
+                         ciphertext + bytes(-len(ciphertext) % 16) + lengths)
+        return xor_span(self.encrypt_block(counter0.to_bytes(16, 'big')), s.to_bytes(16, 'big'))
+
+    def encrypt_gcm(self, plaintext, iv, associated_data=b''):
+        """
+        Encrypts `plaintext` using GCM mode (NIST SP 800-38D) with the given
+        initialization vector (iv, preferably 12 bytes), authenticating it
+        together with `associated_data`.
+
+        Returns the ciphertext, which has the same length as the plaintext
+        (no padding), followed by the 16 byte authentication tag.
+        """
+        assert len(iv) > 0
+
+        table, counter0 = self._gcm_counter0(iv)
+        ciphertext = self._gcm_ctr(plaintext, counter0)
+        return ciphertext + self._gcm_tag(table, counter0, associated_data, ciphertext)
 
+    def decrypt_gcm(self, ciphertext, iv, associated_data=b''):
+        """
+        Verifies and decrypts the output of `encrypt_gcm`, given the same
+        initialization vector (iv) and `associated_data`.
+        """
+        self.verify_gcm(ciphertext, iv, associated_data)
+        table, counter0 = self._gcm_counter0(iv)
+        return self._gcm_ctr(ciphertext[:-16], counter0)
+
+    def verify_gcm(self, ciphertext, iv, associated_data=b''):
+        """
+        Checks the tag of the output of `encrypt_gcm` without decrypting it,
+        raising AuthenticationError if it is missing or does not match.
+        """
+        assert len(iv) > 0
+        if len(ciphertext) < 16:
+            raise AuthenticationError('Ciphertext must contain the 16 byte tag.')
+
+        ciphertext, tag = ciphertext[:-16], ciphertext[-16:]
+        table, counter0 = self._gcm_counter0(iv)
+        expected_tag = self._gcm_tag(table, counter0, associated_data, ciphertext)
+        if not compare_digest(tag, expected_tag):
+            raise AuthenticationError('Ciphertext corrupted or tampered.')
+
+
+import mmap
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from hashlib import pbkdf2_hmac
 from hmac import new as new_hmac, compare_digest
+from itertools import islice, repeat
+
+
+def ctr_keystream(aes, counter, count):
+    """
+    Returns `count` blocks of CTR keystream for `aes`, starting at the integer
+    `counter`. Counters wrap around at 2^128, see `counter_blocks`.
+
+    Module-level so it can be sent to worker processes.
+    """
+    return aes.encrypt_blocks(counter_blocks(counter, count))
+
+
+def run_blocks(aes, method, data):
+    """
+    Returns `aes.<method>(data)`, where method is 'encrypt_blocks' or
+    'decrypt_blocks'. Module-level so it can be sent to worker processes.
+    """
+    return getattr(aes, method)(data)
+
+
+many_modes = ('cbc', 'ctr')
+
+def encrypt_many(keys, ivs, plaintexts, mode='cbc'):
+    """
+    Encrypts each of `plaintexts` under its own key and IV, from the parallel
+    lists `keys`, `ivs` and `plaintexts`, using `mode` (one of `many_modes`)
+    and PKCS#7 padding. Returns the list of ciphertexts, the same as
+    `AES(key).encrypt_<mode>(plaintext, iv)` for each.
+
+    With NumPy, the key schedules of all keys of a size are expanded together
+    and the blocks of all messages go through the rounds in one batch: all
+    CTR blocks at once, and CBC blocks by position in the messages.
+    """
+    return _process_many(keys, ivs, [pad(plaintext) for plaintext in plaintexts], mode, False)
+
+def decrypt_many(keys, ivs, ciphertexts, mode='cbc'):
+    """
+    Decrypts the output of `encrypt_many`, given the same keys and IVs.
+    Every block of every message is independent, so all of them are
+    processed in one batch.
+    """
+    return [unpad(plaintext) for plaintext in _process_many(keys, ivs, ciphertexts, mode, True)]
+
+def _process_many(keys, ivs, messages, mode, decrypt):
+    assert mode in many_modes, 'Unknown mode %r.' % (mode,)
+    assert len(keys) == len(ivs) == len(messages)
+    for key, iv, message in zip(keys, ivs, messages):
+        assert len(key) in AES.rounds_by_key_size
+        assert len(iv) == 16
+        assert len(message) % 16 == 0, "Ciphertext must be made of full 16-byte blocks."
+
+    if np is None:
+        outputs = []
+        for key, iv, message in zip(keys, ivs, messages):
+            output = bytearray(len(message))
+            aes = AES(key, 'table')
+            (aes.decrypt_into if decrypt else aes.encrypt_into)(mode, message, output, iv)
+            outputs.append(bytes(output))
+        return outputs
+
+    outputs = [None] * len(keys)
+    by_size = {}
+    for index, key in enumerate(keys):
+        by_size.setdefault(len(key), []).append(index)
+    for indexes in by_size.values():
+        key_array = np.frombuffer(b''.join(keys[i] for i in indexes), dtype=np.uint8)
+        round_keys = expand_keys_array(key_array.reshape(len(indexes), -1))
+        group_ivs = [ivs[i] for i in indexes]
+        group_messages = [messages[i] for i in indexes]
+        if mode == 'cbc' and not decrypt:
+            group_outputs = _encrypt_cbc_many(round_keys, group_ivs, group_messages)
+        else:
+            group_outputs = _independent_many(round_keys, group_ivs, group_messages, mode)
+        for index, output in zip(indexes, group_outputs):
+            outputs[index] = output
+    return outputs
+
+def _independent_many(round_keys, ivs, messages, mode):
+    """
+    CTR (either direction) and CBC decryption, where all blocks of all
+    messages are independent: one batch over the concatenated blocks, each
+    with the round keys of its message.
+    """
+    counts = [len(message) // 16 for message in messages]
+    owners = np.repeat(np.arange(len(messages)), counts)
+    data = np.frombuffer(b''.join(messages), dtype=np.uint8).reshape(-1, 16)
+    if mode == 'ctr':
+        inputs = b''.join(counter_blocks(int.from_bytes(iv, 'big'), count) for iv, count in zip(ivs, counts))
+        inputs, process = np.frombuffer(inputs, dtype=np.uint8).reshape(-1, 16), encrypt_array
+        # CTR mode: data_block XOR encrypt(nonce)
+        mask = data
+    else:
+        inputs, process = data, decrypt_array
+        # CBC mode decrypt: previous XOR decrypt(ciphertext)
+        previous = b''.join(iv + message[:-16] for iv, message in zip(ivs, messages))
+        mask = np.frombuffer(previous, dtype=np.uint8).reshape(-1, 16)
+
+    out = np.empty_like(data)
+    for start in range(0, len(data), AES.batch_size):
+        end = start + AES.batch_size
+        out[start:end] = process(inputs[start:end], round_keys[:, owners[start:end]]) ^ mask[start:end]
+    out = out.tobytes()
+    offsets = np.cumsum([0] + counts) * 16
+    return [out[offsets[i]:offsets[i + 1]] for i in range(len(messages))]
+
+def _encrypt_cbc_many(round_keys, ivs, messages):
+    """
+    CBC encryption of many messages: block j of every message that has one
+    is encrypted in the same batch. Messages are sorted longest first so the
+    ones still running are a prefix.
+    """
+    counts = np.array([len(message) // 16 for message in messages])
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    order = np.argsort(-counts, kind='stable')
+    data = np.frombuffer(b''.join(messages), dtype=np.uint8).reshape(-1, 16)
+    out = np.empty_like(data)
+
+    for first in range(0, len(messages), AES.batch_size):
+        chunk = order[first:first + AES.batch_size]
+        keys = round_keys[:, chunk]
+        state = np.frombuffer(b''.join(ivs[i] for i in chunk), dtype=np.uint8).reshape(-1, 16).copy()
+        chunk_counts, chunk_offsets = counts[chunk], offsets[chunk]
+        for j in range(chunk_counts[0] if len(chunk) else 0):
+            running = np.count_nonzero(chunk_counts > j)
+            positions = chunk_offsets[:running] + j
+            # CBC mode encrypt: encrypt(plaintext_block XOR previous)
+            state[:running] = encrypt_array(data[positions] ^ state[:running], keys[:, :running])
+            out[positions] = state[:running]
+
+    out = out.tobytes()
+    return [out[16 * offset:16 * (offset + count)] for offset, count in zip(offsets, counts)]
+
+
+def gcm_multiplication_table(h):
+    """
+    Precomputes products with the GCM hash key `h` (an integer, in GCM bit
+    order) for an 8-bit table-driven GHASH: `table[i][b]` is h times the
+    element whose only non-zero byte is `b` at position i, so multiplying
+    any block by h is the XOR of 16 lookups.
+    """
+    # powers[j] = h * x^j. Multiplying by x is a right shift in GCM bit order,
+    # reduced by x^128 + x^7 + x^2 + x + 1.
+    powers = []
+    for j in range(128):
+        powers.append(h)
+        h = (h >> 1) ^ (0xE1 << 120) if h & 1 else h >> 1
+
+    table = []
+    for i in range(16):
+        row = [0] * 256
+        for b in range(1, 256):
+            # Bit k of byte i is the coefficient of x^(8i + 7 - k).
+            low = b & -b
+            row[b] = row[b ^ low] ^ powers[8 * i + 8 - low.bit_length()]
+        table.append(row)
+    return table
+
+
+def ghash(table, data, y=0):
+    """
+    Returns GHASH of `data` (a multiple of 16 bytes) as an integer, using the
+    table from `gcm_multiplication_table`, starting from the hash state `y`.
+    """
+    for offset in range(0, len(data), 16):
+        x = (y ^ int.from_bytes(data[offset:offset+16], 'big')).to_bytes(16, 'big')
+        y = 0
+        for row, b in zip(table, x):
+            y ^= row[b]
+    return y
+
 
 AES_KEY_SIZE = 16
 HMAC_KEY_SIZE = 16
@@ -464,10 +1708,229 @@ IV_SIZE = 16
 SALT_SIZE = 16
 HMAC_SIZE = 32
 
+class KeyScheduleCache:
+    """
+    Bounded LRU cache of `AES` objects by master key, so repeated operations
+    under the same key skip key expansion. Each cached object holds both the
+    encryption round keys and the decryption-ready inverse round keys.
+
+    `use` lends an object for the duration of a `with` block; it is zeroized
+    once it has left the cache (evicted, invalidated or cleared) and the last
+    borrower is done with it. Objects returned by `get` may be kept as long
+    as the caller likes, so the cache never zeroizes them. The cache can be
+    shared between threads. `hits` and `misses` count lookups since creation
+    or the last `clear`.
+    """
+    def __init__(self, maxsize=32, engine='matrix'):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.engine = engine
+        self.hits = 0
+        self.misses = 0
+        # Entries are [aes, borrowers, returned by `get`].
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, master_key):
+        """
+        Returns the entry for `master_key`, expanding it on a miss. Called
+        with the lock held.
+        """
+        entry = self._entries.get(master_key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(master_key)
+            return entry
+
+        self.misses += 1
+        entry = self._entries[master_key] = [AES(master_key, self.engine), 0, False]
+        while len(self._entries) > self.maxsize:
+            _, evicted = self._entries.popitem(last=False)
+            self._zeroize_unused(evicted)
+        return entry
+
+    @staticmethod
+    def _zeroize_unused(entry):
+        """ Zeroizes an entry that has left the cache, unless still in use. """
+        aes, borrowers, returned = entry
+        if not borrowers and not returned:
+            aes.zeroize()
+
+    def get(self, master_key):
+        """
+        Returns the `AES` object for `master_key`, expanding it on a miss.
+        The cache will not zeroize it, see `use`.
+        """
+        with self._lock:
+            entry = self._lookup(bytes(master_key))
+            entry[2] = True
+            return entry[0]
+
+    @contextmanager
+    def use(self, master_key):
+        """
+        Lends the `AES` object for `master_key` until the `with` block exits,
+        even if it is evicted meanwhile:
+
+            with cache.use(key) as aes:
+                ciphertext = aes.encrypt_cbc(plaintext, iv)
+        """
+        master_key = bytes(master_key)
+        with self._lock:
+            entry = self._lookup(master_key)
+            entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if self._entries.get(master_key) is not entry:
+                    self._zeroize_unused(entry)
+
+    def invalidate(self, master_key):
+        """
+        Removes the entry for `master_key`, if any, zeroizing it when unused.
+        """
+        with self._lock:
+            entry = self._entries.pop(bytes(master_key), None)
+            if entry is not None:
+                self._zeroize_unused(entry)
+
+    def clear(self):
+        """
+        Removes all entries, zeroizing the unused ones, and resets the
+        counters.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                self._zeroize_unused(entry)
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self):
+        """
+        Returns the cache counters as a dict.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+# Lends the expanded keys of `encrypt`, `decrypt`, `Session` and the stream
+# and container functions, so a key seen again (a `Session` key, or a salt
+# cached by `enable_derived_key_cache`) is not expanded again.
+key_schedule_cache = KeyScheduleCache()
+
+
+class DerivedKeyCache:
+    """
+    Cache of `get_key_iv` results by (password, salt, workload), bounded both
+    in size (least recently used entries go first) and in age (`ttl` seconds),
+    so decrypting many records that share a salt stretches the password once.
+
+    Note the cache keeps passwords and derived keys in memory for up to `ttl`
+    seconds. The cache can be shared between threads. `hits`, `misses` and
+    `expired` count lookups since creation or the last `clear`.
+    """
+    def __init__(self, maxsize=128, ttl=300.0, clock=time.monotonic):
+        assert maxsize > 0 and ttl > 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, password, salt, workload):
+        """
+        Returns (aes_key, hmac_key, iv), running PBKDF2 only on a miss.
+        """
+        entry_key = (bytes(password), bytes(salt), workload)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None:
+                expires, value = entry
+                if now < expires:
+                    self.hits += 1
+                    self._entries.move_to_end(entry_key)
+                    return value
+                self.expired += 1
+                del self._entries[entry_key]
+            self.misses += 1
+
+        # PBKDF2 runs without the lock, so other keys are not held up by it.
+        value = stretch_key(password, salt, workload)
+        with self._lock:
+            self._entries[entry_key] = (now + self.ttl, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.expired = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self):
+        """
+        Returns the cache counters as a dict.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'expired': self.expired,
+                    'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl}
+
+
+# Opt-in, see `enable_derived_key_cache`.
+derived_key_cache = None
+
+
+def enable_derived_key_cache(maxsize=128, ttl=300.0):
+    """
+    Makes `get_key_iv` (and so `encrypt` and `decrypt`) cache derived keys
+    in this process, and returns the new `DerivedKeyCache`.
+    """
+    global derived_key_cache
+    derived_key_cache = DerivedKeyCache(maxsize, ttl)
+    return derived_key_cache
+
+
+def disable_derived_key_cache():
+    """
+    Stops caching derived keys and drops the cached ones.
+    """
+    global derived_key_cache
+    if derived_key_cache is not None:
+        derived_key_cache.clear()
+    derived_key_cache = None
+
+
 def get_key_iv(password, salt, workload=100000):
     """
     Stretches the password and extracts an AES key, an HMAC key and an AES
-    initialization vector.
+    initialization vector, through the derived key cache if it is enabled.
+    """
+    if derived_key_cache is not None:
+        return derived_key_cache.get(password, salt, workload)
+    return stretch_key(password, salt, workload)
+
+
+def stretch_key(password, salt, workload=100000):
+    """
+    Runs PBKDF2 on the password and splits the result into an AES key, an
+    HMAC key and an AES initialization vector.
     """
     stretched = pbkdf2_hmac('sha256', password, salt, workload, AES_KEY_SIZE + IV_SIZE + HMAC_KEY_SIZE)
     aes_key, rest = stretched[:AES_KEY_SIZE], stretched[AES_KEY_SIZE:]
@@ -490,7 +1953,8 @@ def encrypt(key, plaintext, workload=100000):
 
     salt = os.urandom(SALT_SIZE)
     key, hmac_key, iv = get_key_iv(key, salt, workload)
-    ciphertext = AES(key).encrypt_cbc(plaintext, iv)
+    with key_schedule_cache.use(key) as aes:
+        ciphertext = aes.encrypt_cbc(plaintext, iv)
     hmac = new_hmac(hmac_key, salt + ciphertext, 'sha256').digest()
     assert len(hmac) == HMAC_SIZE
 
@@ -520,9 +1984,496 @@ def decrypt(key, ciphertext, workload=100000):
     key, hmac_key, iv = get_key_iv(key, salt, workload)
 
     expected_hmac = new_hmac(hmac_key, salt + ciphertext, 'sha256').digest()
-    assert compare_digest(hmac, expected_hmac), 'Ciphertext corrupted or tampered.'
+    if not compare_digest(hmac, expected_hmac):
+        raise AuthenticationError('Ciphertext corrupted or tampered.')
+
+    with key_schedule_cache.use(key) as aes:
+        return aes.decrypt_cbc(ciphertext, iv)
+
+
+class Session:
+    """
+    Derives the keys for `password` once, with a random salt, and then
+    encrypts many messages under them with a fresh random IV each.
+
+    Messages are HMAC + salt + IV + ciphertext (AES-128 in CBC mode), with
+    the HMAC over salt + IV + ciphertext. `decrypt` also accepts messages
+    from other sessions of the same password, re-deriving their keys
+    through `get_key_iv`.
+    """
+    def __init__(self, password, workload=100000):
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        self.workload = workload
+        self.salt = os.urandom(SALT_SIZE)
+        self._password = password
+        self._aes_key, self._hmac_key, _ = get_key_iv(password, self.salt, workload)
+
+    def encrypt(self, plaintext):
+        """
+        Encrypts `plaintext` with the session keys and a fresh IV.
+        """
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode('utf-8')
+
+        iv = os.urandom(IV_SIZE)
+        with key_schedule_cache.use(self._aes_key) as aes:
+            ciphertext = aes.encrypt_cbc(plaintext, iv)
+        data = self.salt + iv + ciphertext
+        return new_hmac(self._hmac_key, data, 'sha256').digest() + data
+
+    def decrypt(self, ciphertext):
+        """
+        Verifies and decrypts a message produced by `Session.encrypt`.
+        """
+        assert len(ciphertext) >= HMAC_SIZE + SALT_SIZE + IV_SIZE + 16, 'Ciphertext too short.'
+        assert len(ciphertext) % 16 == 0, "Ciphertext must be made of full 16-byte blocks."
+
+        hmac, data = ciphertext[:HMAC_SIZE], ciphertext[HMAC_SIZE:]
+        salt = data[:SALT_SIZE]
+        iv, ciphertext = data[SALT_SIZE:SALT_SIZE + IV_SIZE], data[SALT_SIZE + IV_SIZE:]
+        if salt == self.salt:
+            aes_key, hmac_key = self._aes_key, self._hmac_key
+        else:
+            aes_key, hmac_key, _ = get_key_iv(self._password, salt, self.workload)
+
+        expected_hmac = new_hmac(hmac_key, data, 'sha256').digest()
+        if not compare_digest(hmac, expected_hmac):
+            raise AuthenticationError('Ciphertext corrupted or tampered.')
 
-    return AES(key).decrypt_cbc(ciphertext, iv)
+        with key_schedule_cache.use(aes_key) as aes:
+            return aes.decrypt_cbc(ciphertext, iv)
+
+
+class StreamEncryptor:
+    """
+    Incremental CBC or CTR encryption with PKCS#7 padding.
+
+    Feed the plaintext in pieces of any size to `update`, which returns the
+    ciphertext of every whole block seen so far, then call `finalize` for the
+    padded last block. The chaining value (previous ciphertext block for CBC,
+    counter for CTR) is carried between calls, so the concatenated output is
+    the same as `AES.encrypt_cbc` or `AES.encrypt_ctr` on the whole message.
+    """
+    modes = ('cbc', 'ctr')
+    def __init__(self, aes, iv, mode='cbc'):
+        assert len(iv) == 16
+        assert mode in StreamEncryptor.modes
+        self.aes = aes
+        self.mode = mode
+        self._previous = iv
+        self._counter = int.from_bytes(iv, 'big')
+        self._buffer = b''
+
+    def _process(self, data):
+        if self.mode == 'ctr':
+            count = len(data) // 16
+            keystream = ctr_keystream(self.aes, self._counter, count)
+            self._counter += count
+            return xor_span(data, keystream)
+
+        blocks = []
+        previous = self._previous
+        for plaintext_block in split_blocks(data):
+            # CBC mode encrypt: encrypt(plaintext_block XOR previous)
+            previous = self.aes.encrypt_block(xor_bytes(plaintext_block, previous))
+            blocks.append(previous)
+        self._previous = previous
+        return b''.join(blocks)
+
+    def update(self, data):
+        """
+        Encrypts the next piece of plaintext, returning the ciphertext of all
+        whole blocks available so far.
+        """
+        assert self._buffer is not None, 'Encryptor already finalized.'
+        data = self._buffer + data
+        end = len(data) - len(data) % 16
+        self._buffer = data[end:]
+        return self._process(data[:end])
+
+    def finalize(self):
+        """
+        Pads and encrypts the remaining plaintext, returning the last block(s).
+        """
+        assert self._buffer is not None, 'Encryptor already finalized.'
+        last, self._buffer = pad(self._buffer), None
+        return self._process(last)
+
+
+class StreamDecryptor:
+    """
+    Incremental CBC or CTR decryption, the counterpart of `StreamEncryptor`.
+
+    The last whole block is held back until `finalize`, which removes and
+    checks the PKCS#7 padding.
+    """
+    def __init__(self, aes, iv, mode='cbc'):
+        assert len(iv) == 16
+        assert mode in StreamEncryptor.modes
+        self.aes = aes
+        self.mode = mode
+        self._previous = iv
+        self._counter = int.from_bytes(iv, 'big')
+        self._buffer = b''
+
+    def _process(self, data):
+        if self.mode == 'ctr':
+            count = len(data) // 16
+            keystream = ctr_keystream(self.aes, self._counter, count)
+            self._counter += count
+            return xor_span(data, keystream)
+
+        # CBC mode decrypt: previous XOR decrypt(ciphertext)
+        previous = self._previous + data[:-16]
+        self._previous = data[-16:]
+        return xor_span(self.aes.decrypt_blocks(data), previous)
+
+    def update(self, data):
+        """
+        Decrypts the next piece of ciphertext, returning the plaintext of all
+        whole blocks available so far except the last one.
+        """
+        assert self._buffer is not None, 'Decryptor already finalized.'
+        data = self._buffer + data
+        end = len(data) - (len(data) % 16 or 16)
+        if end <= 0:
+            self._buffer = data
+            return b''
+        self._buffer = data[end:]
+        return self._process(data[:end])
+
+    def finalize(self):
+        """
+        Decrypts the last block and returns it without padding.
+        """
+        assert self._buffer is not None, 'Decryptor already finalized.'
+        assert len(self._buffer) == 16, 'Ciphertext must be made of full 16-byte blocks.'
+        last, self._buffer = self._buffer, None
+        return unpad(self._process(last))
+
+
+def encrypt_stream(key, source, destination, workload=100000, chunk_size=1 << 16):
+    """
+    Encrypts the binary file object `source` into `destination`, reading
+    `chunk_size` bytes at a time, so memory use does not depend on the input
+    size.
+
+    The output has the same format as `encrypt`. Since the HMAC comes first,
+    `destination` must be seekable: a placeholder is written and filled in
+    once the whole ciphertext has been authenticated.
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+
+    salt = os.urandom(SALT_SIZE)
+    key, hmac_key, iv = get_key_iv(key, salt, workload)
+    hmac = new_hmac(hmac_key, salt, 'sha256')
+
+    start = destination.tell()
+    destination.write(bytes(HMAC_SIZE) + salt)
+    with key_schedule_cache.use(key) as aes:
+        encryptor = StreamEncryptor(aes, iv)
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            ciphertext = encryptor.update(chunk)
+            hmac.update(ciphertext)
+            destination.write(ciphertext)
+        ciphertext = encryptor.finalize()
+    hmac.update(ciphertext)
+    destination.write(ciphertext)
+
+    end = destination.tell()
+    destination.seek(start)
+    destination.write(hmac.digest())
+    destination.seek(end)
+
+
+def decrypt_stream(key, source, destination, workload=100000, chunk_size=1 << 16):
+    """
+    Decrypts the output of `encrypt` or `encrypt_stream` from the binary file
+    object `source` into `destination`, `chunk_size` bytes at a time.
+
+    `source` must be seekable: the HMAC is verified in a first pass, so no
+    plaintext is written unless the whole ciphertext is authentic. It is
+    checked again while decrypting, and if `source` changed in between the
+    last block is withheld and AuthenticationError raised.
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+
+    start = source.tell()
+    hmac, salt = source.read(HMAC_SIZE), source.read(SALT_SIZE)
+    assert len(salt) == SALT_SIZE, 'Ciphertext too short.'
+    key, hmac_key, iv = get_key_iv(key, salt, workload)
+
+    expected_hmac = new_hmac(hmac_key, salt, 'sha256')
+    length = 0
+    for chunk in iter(lambda: source.read(chunk_size), b''):
+        expected_hmac.update(chunk)
+        length += len(chunk)
+    assert length % 16 == 0, "Ciphertext must be made of full 16-byte blocks."
+    assert length >= 16, 'Ciphertext must contain at least one block.'
+    if not compare_digest(hmac, expected_hmac.digest()):
+        raise AuthenticationError('Ciphertext corrupted or tampered.')
+
+    source.seek(start + HMAC_SIZE + SALT_SIZE)
+    expected_hmac = new_hmac(hmac_key, salt, 'sha256')
+    with key_schedule_cache.use(key) as aes:
+        decryptor = StreamDecryptor(aes, iv)
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            expected_hmac.update(chunk)
+            destination.write(decryptor.update(chunk))
+        if not compare_digest(hmac, expected_hmac.digest()):
+            raise AuthenticationError('Ciphertext changed while decrypting.')
+        destination.write(decryptor.finalize())
+
+
+def encrypt_file(key, source_path, destination_path, workload=100000, chunk_size=1 << 16):
+    """
+    Encrypts the file at `source_path` into `destination_path` with
+    `encrypt_stream`.
+    """
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        encrypt_stream(key, source, destination, workload, chunk_size)
+
+
+def decrypt_file(key, source_path, destination_path, workload=100000, chunk_size=1 << 16):
+    """
+    Decrypts the file at `source_path` into `destination_path` with
+    `decrypt_stream`.
+    """
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        decrypt_stream(key, source, destination, workload, chunk_size)
+
+
+CONTAINER_MAGIC = b'AESC'
+CONTAINER_VERSION = 1
+CONTAINER_HEADER_SIZE = 9 + SALT_SIZE
+TAG_SIZE = 16
+
+def container_chunk(aes, operation, data, index, final, header):
+    """
+    Encrypts ('encrypt'), verifies and decrypts ('decrypt') or only verifies
+    ('verify') chunk number `index` of a container with AES-GCM. The IV is
+    the chunk number, and the header, chunk number and last-chunk flag are
+    authenticated with it, so chunks cannot be reordered, dropped or moved
+    between containers. Module-level so it can be sent to worker processes.
+    """
+    iv = index.to_bytes(12, 'big')
+    associated_data = header + pack('>QB', index, final)
+    if operation == 'encrypt':
+        return aes.encrypt_gcm(data, iv, associated_data)
+    try:
+        if operation == 'decrypt':
+            return aes.decrypt_gcm(data, iv, associated_data)
+        aes.verify_gcm(data, iv, associated_data)
+        return b''
+    except AuthenticationError:
+        raise AuthenticationError('Chunk %d corrupted, tampered or truncated.' % index)
+
+
+def _read_chunks(source, size):
+    """
+    Yields (index, data, final) for consecutive `size` byte pieces of
+    `source`; the last one is shorter, possibly empty.
+    """
+    index = 0
+    while True:
+        data = source.read(size)
+        final = len(data) < size
+        yield index, data, final
+        if final:
+            return
+        index += 1
+
+
+def _process_container(aes, operation, chunks, header, destination, workers, executor):
+    """
+    Runs `container_chunk` over `chunks` in groups of as many chunks as
+    workers, writing the results to `destination` in order.
+    """
+    group = workers or os.cpu_count() or 1
+    pool = None
+    if executor is None and group > 1:
+        executor = pool = ProcessPoolExecutor(workers)
+    try:
+        while True:
+            batch = list(islice(chunks, group))
+            if not batch:
+                break
+            indexes, datas, finals = zip(*batch)
+            n = len(batch)
+            results = aes._pool_map(container_chunk, 1 if executor is None else None, executor,
+                                    [operation] * n, datas, indexes, finals, [header] * n)
+            for result in results:
+                if destination is not None:
+                    destination.write(result)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def encrypt_container(key, source, destination, workload=100000, chunk_size=1 << 20,
+                      workers=None, executor=None):
+    """
+    Encrypts the binary file object `source` into `destination` in the
+    chunked container format:
+
+        magic 'AESC' + version (1 byte) + chunk size (4 bytes) + salt
+        chunk 0: AES-GCM(chunk_size bytes) + tag
+        ...
+        last chunk: AES-GCM(0 to chunk_size - 1 bytes) + tag
+
+    The AES key comes from PBKDF2 on `key` and the random salt, like
+    `encrypt`. Every chunk is encrypted and authenticated on its own, so
+    chunks are processed in parallel by `workers` processes (or `executor`)
+    and neither side needs to seek or hold more than a group of chunks.
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    assert 0 < chunk_size < 1 << 32
+
+    salt = os.urandom(SALT_SIZE)
+    aes_key, _, _ = get_key_iv(key, salt, workload)
+    header = pack('>4sBI', CONTAINER_MAGIC, CONTAINER_VERSION, chunk_size) + salt
+    destination.write(header)
+    with key_schedule_cache.use(aes_key) as aes:
+        _process_container(aes, 'encrypt', _read_chunks(source, chunk_size),
+                           header, destination, workers, executor)
+
+
+def _open_container(key, source, workload):
+    header = source.read(CONTAINER_HEADER_SIZE)
+    assert len(header) == CONTAINER_HEADER_SIZE, 'Ciphertext too short.'
+    magic, version, chunk_size = unpack_from('>4sBI', header)
+    assert magic == CONTAINER_MAGIC, 'Not a container.'
+    assert version == CONTAINER_VERSION, 'Unsupported container version %d.' % version
+
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    aes_key, _, _ = get_key_iv(key, header[9:], workload)
+    return aes_key, header, _read_chunks(source, chunk_size + TAG_SIZE)
+
+
+def decrypt_container(key, source, destination, workload=100000, workers=None, executor=None):
+    """
+    Verifies and decrypts the output of `encrypt_container` from `source`
+    into `destination`, chunk by chunk and in parallel like the encryption.
+
+    Raises AuthenticationError naming the first corrupted, reordered or missing
+    chunk as soon as it is reached; the chunks before it have been written.
+    Use `verify_container` first to write nothing from a damaged container.
+    """
+    aes_key, header, chunks = _open_container(key, source, workload)
+    with key_schedule_cache.use(aes_key) as aes:
+        _process_container(aes, 'decrypt', chunks, header, destination, workers, executor)
+
+
+def verify_container(key, source, workload=100000, workers=None, executor=None):
+    """
+    Checks every chunk tag of the container in `source` without decrypting,
+    raising AuthenticationError at the first bad chunk like `decrypt_container`.
+    """
+    aes_key, header, chunks = _open_container(key, source, workload)
+    with key_schedule_cache.use(aes_key) as aes:
+        _process_container(aes, 'verify', chunks, header, None, workers, executor)
+
+
+def encrypt_mmap(aes, source_path, destination_path, iv, mode='cbc'):
+    """
+    Encrypts the file at `source_path` into `destination_path` using `mode`
+    and PKCS#7 padding, mapping both files in memory and encrypting in place
+    with `AES.encrypt_into`. The output has the same bytes as
+    `aes.encrypt_<mode>(plaintext, iv)`.
+    """
+    size = os.path.getsize(source_path)
+    whole = size - size % 16
+    with open(source_path, 'rb') as source, open(destination_path, 'w+b') as destination:
+        destination.truncate(whole + 16)
+        with mmap.mmap(destination.fileno(), whole + 16) as output:
+            tail = b''
+            if size:
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as input:
+                    with memoryview(input) as src, memoryview(output) as dst:
+                        iv = aes.encrypt_into(mode, src[:whole], dst[:whole], iv)
+                    tail = input[whole:]
+            aes.encrypt_into(mode, pad(tail), memoryview(output)[whole:], iv)
+
+
+def decrypt_mmap(aes, source_path, destination_path, iv, mode='cbc'):
+    """
+    Decrypts the file at `source_path`, encrypted with `encrypt_mmap` or
+    `aes.encrypt_<mode>`, into `destination_path`, decrypting in place with
+    `AES.decrypt_into` and truncating the padding away at the end.
+    """
+    size = os.path.getsize(source_path)
+    assert size % 16 == 0 and size >= 16, 'Ciphertext must be made of full 16-byte blocks.'
+    with open(source_path, 'rb') as source, open(destination_path, 'w+b') as destination:
+        destination.truncate(size)
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as input:
+            with mmap.mmap(destination.fileno(), size) as output:
+                with memoryview(input) as src, memoryview(output) as dst:
+                    aes.decrypt_into(mode, src, dst, iv)
+                last_block = unpad(output[-16:])
+        destination.truncate(size - 16 + len(last_block))
+
+
+class CtrReader:
+    """
+    Random access to CTR mode ciphertext: `read(offset, length)` returns that
+    range of the plaintext, decrypting only the blocks it covers. Block i of
+    the keystream is the encryption of `iv + i`, so the counter is computed
+    directly from the offset.
+
+    `source` is the ciphertext as a bytes-like object (bytes, mmap, ...) or a
+    seekable binary file. With `padded`, it comes from `AES.encrypt_ctr` or a
+    CTR `StreamEncryptor`, and reads stop before the PKCS#7 padding.
+    """
+    def __init__(self, aes, source, iv, padded=True):
+        assert len(iv) == 16
+        self.aes = aes
+        self.source = source
+        self.padded = padded
+        self._counter = int.from_bytes(iv, 'big')
+        if hasattr(source, 'seek'):
+            self._length = source.seek(0, os.SEEK_END)
+        else:
+            self._length = len(source)
+        self._size = None
+
+    @property
+    def size(self):
+        """ Length of the plaintext, found by decrypting the last block. """
+        if self._size is None:
+            if self.padded:
+                assert self._length % 16 == 0 and self._length >= 16, \
+                    'Ciphertext must be made of full 16-byte blocks.'
+                self._size = self._length - 16 + len(unpad(self._decrypt(self._length - 16, 16)))
+            else:
+                self._size = self._length
+        return self._size
+
+    def _decrypt(self, start, length):
+        """ Decrypts `length` bytes from the block-aligned offset `start`. """
+        if hasattr(self.source, 'seek'):
+            self.source.seek(start)
+            ciphertext = self.source.read(length)
+        else:
+            ciphertext = bytes(self.source[start:start + length])
+        keystream = ctr_keystream(self.aes, self._counter + start // 16, (len(ciphertext) + 15) // 16)
+        return xor_span(ciphertext, keystream[:len(ciphertext)])
+
+    def read(self, offset, length):
+        """
+        Returns up to `length` bytes of plaintext starting at `offset`, fewer
+        if the plaintext ends first.
+        """
+        assert offset >= 0 and length >= 0
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return b''
+        start = offset - offset % 16
+        return self._decrypt(start, end - start)[offset - start:]
 
 
 def benchmark():
@@ -532,6 +2483,60 @@ def benchmark():
     for i in range(30000):
         aes.encrypt_block(message)
 
+def trace_allocations(function, n_blocks):
+    """
+    Runs `function` under tracemalloc and returns the bytes it left
+    allocated per block, and the most it held at once above the starting
+    point, in bytes.
+    """
+    import tracemalloc
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    function()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / n_blocks, peak - before
+
+def benchmark_allocations(n_blocks=4096):
+    """
+    Compares with tracemalloc the memory allocated for `n_blocks` blocks by
+    the matrix engine and the in-place 'flat' engine: the block loop alone
+    (`encrypt_state`/`decrypt_state` on one bytearray), `encrypt_cbc` and
+    `decrypt_cbc`, which return new bytes objects, and `encrypt_into` and
+    `decrypt_into` on a preallocated buffer.
+
+    Net is what stays allocated per block. The peak, the most held at once,
+    includes the output and other buffers of the whole message for the
+    modes; for the block loop it is the working set of a single block.
+    """
+    iv = b'I' * 16
+    message = b'M' * (16 * n_blocks)
+    output = bytearray(len(message))
+    for engine in ('matrix', 'flat'):
+        aes = AES(b'P' * 16, engine)
+        state = bytearray(16)
+        ciphertext = aes.encrypt_cbc(message, iv)
+        unpadded = ciphertext[:len(message)]
+
+        def blocks(function):
+            for _ in range(n_blocks):
+                function(state)
+
+        runs = (
+            ('encrypt_state', lambda: blocks(aes.encrypt_state)),
+            ('decrypt_state', lambda: blocks(aes.decrypt_state)),
+            ('encrypt_cbc', lambda: aes.encrypt_cbc(message, iv)),
+            ('decrypt_cbc', lambda: aes.decrypt_cbc(ciphertext, iv)),
+            ('encrypt_into', lambda: aes.encrypt_into('cbc', message, output, iv)),
+            ('decrypt_into', lambda: aes.decrypt_into('cbc', unpadded, output, iv)),
+        )
+        for name, run in runs:
+            run()  # Warms up the key schedules and the interpreter caches.
+            net, peak = trace_allocations(run, n_blocks)
+            print('%-6s %-13s net %6.2f bytes per block, peak %8d bytes' % (engine, name, net, peak))
+
+
 __all__ = [encrypt, decrypt, AES]
 
 if __name__ == '__main__':
@@ -544,10 +2549,26 @@ if __name__ == '__main__':
         print('Running tests...')
         from tests import *
         run()
-    elif len(sys.argv) == 2 and sys.argv[1] == 'benchmark':
-        benchmark()
+    elif sys.argv[1] == 'benchmark':
+        from benchmark import main
+        main(sys.argv[2:])
+        exit()
+    elif sys.argv[1] == 'profile':
+        from profiler import main
+        main(sys.argv[2:])
+        exit()
+    elif len(sys.argv) == 2 and sys.argv[1] == 'benchmark_allocations':
+        benchmark_allocations()
         exit()
     elif len(sys.argv) == 3:
+        # Stream through files when possible instead of reading them whole:
+        # encryption needs to seek back to the HMAC, decryption reads twice.
+        if 'encrypt'.startswith(sys.argv[1]) and sys.stdout.buffer.seekable():
+            encrypt_stream(sys.argv[2], sys.stdin.buffer, sys.stdout.buffer)
+            exit()
+        elif 'decrypt'.startswith(sys.argv[1]) and sys.stdin.buffer.seekable():
+            decrypt_stream(sys.argv[2], sys.stdin.buffer, sys.stdout.buffer)
+            exit()
         text = read()
     elif len(sys.argv) > 3:
         text = ' '.join(sys.argv[2:])
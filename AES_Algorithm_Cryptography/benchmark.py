@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for aes.py.
+
+Measures throughput (MB/s) and per-call latency percentiles of every block
+mode, key size and message size, for the raw `AES` methods and for the
+high-level `encrypt`/`decrypt` functions, and prints the results as JSON so
+runs of different engines or revisions can be compared:
+
+    ./aes.py benchmark --engines matrix table --sizes 16 1K 64K > after.json
+    ./aes.py benchmark --baseline before.json > after.json
+
+Message sizes accept K and M suffixes, up to 64M. The pure Python engines
+process well under 1 MB/s, so large sizes take minutes per measurement.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from aes import AES, encrypt, decrypt, np
+
+MODES = ('cbc', 'pcbc', 'cfb', 'ofb', 'ctr')
+KEY_SIZES = (128, 192, 256)
+DEFAULT_SIZES = ('16', '1K', '64K')
+MAX_SIZE = 64 << 20
+
+
+def parse_size(text):
+    """
+    Parses a message size such as '16', '1K' or '64M' into bytes, raising
+    argparse.ArgumentTypeError for anything else.
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20}
+    upper = text.upper()
+    try:
+        size = int(upper[:-1]) * units[upper[-1]] if upper[-1:] in units else int(upper)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid message size %r.' % text)
+    if not 0 < size <= MAX_SIZE:
+        raise argparse.ArgumentTypeError('Message sizes go from 1 byte to 64M.')
+    return size
+
+
+def percentile(sorted_values, q):
+    """
+    Returns the nearest-rank `q` percentile (0-100) of `sorted_values`.
+    """
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def measure(function, repeat=5, min_time=0.2):
+    """
+    Calls `function` at least `repeat` times and for at least `min_time`
+    seconds, returning the duration of each call in seconds.
+    """
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < repeat or time.perf_counter() - start < min_time:
+        before = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - before)
+    return timings
+
+
+def summarize(timings, size):
+    """
+    Returns throughput and latency statistics for calls on `size` bytes.
+    """
+    timings = sorted(timings)
+    median = percentile(timings, 50)
+    return {
+        'calls': len(timings),
+        'mb_per_s': size / median / 1e6,
+        'mean_s': sum(timings) / len(timings),
+        'min_s': timings[0],
+        'p50_s': median,
+        'p90_s': percentile(timings, 90),
+        'p99_s': percentile(timings, 99),
+        'max_s': timings[-1],
+    }
+
+
+def run(modes=MODES, key_sizes=KEY_SIZES, sizes=DEFAULT_SIZES, engines=('matrix',),
+        functions=True, repeat=5, min_time=0.2, workload=100000):
+    """
+    Runs every combination and returns the report as a dict. `sizes` are
+    byte counts or strings for `parse_size`.
+
+    `functions` adds `encrypt`/`decrypt`, which always use AES-128 in CBC
+    mode and PBKDF2 with the given `workload`.
+    """
+    results = []
+    iv = os.urandom(16)
+    for size in (parse_size(size) if isinstance(size, str) else size for size in sizes):
+        message = os.urandom(size)
+        for engine in engines:
+            for key_bits in key_sizes:
+                aes = AES(os.urandom(key_bits // 8), engine)
+                for mode in modes:
+                    encrypt_mode = getattr(aes, 'encrypt_' + mode)
+                    decrypt_mode = getattr(aes, 'decrypt_' + mode)
+                    ciphertext = encrypt_mode(message, iv)
+                    for operation, call in (('encrypt', lambda: encrypt_mode(message, iv)),
+                                            ('decrypt', lambda: decrypt_mode(ciphertext, iv))):
+                        entry = {'api': 'method', 'engine': engine, 'operation': operation,
+                                 'mode': mode, 'key_bits': key_bits, 'message_bytes': size}
+                        entry.update(summarize(measure(call, repeat, min_time), size))
+                        results.append(entry)
+
+        if functions:
+            key = os.urandom(16)
+            ciphertext = encrypt(key, message, workload)
+            for operation, call in (('encrypt', lambda: encrypt(key, message, workload)),
+                                    ('decrypt', lambda: decrypt(key, ciphertext, workload))):
+                entry = {'api': 'function', 'engine': 'matrix', 'operation': operation,
+                         'mode': 'cbc', 'key_bits': 128, 'message_bytes': size, 'workload': workload}
+                entry.update(summarize(measure(call, repeat, min_time), size))
+                results.append(entry)
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'numpy': np.__version__ if np is not None else None,
+        'results': results,
+    }
+
+
+def _entry_key(entry):
+    return tuple(entry.get(name) for name in
+                 ('api', 'engine', 'operation', 'mode', 'key_bits', 'message_bytes'))
+
+
+def compare(report, baseline):
+    """
+    Adds to each result of `report` the ratio of its median throughput to
+    the matching result of `baseline` (same api, engine, operation, mode, key
+    and message size), as 'speedup'.
+    """
+    previous = {_entry_key(entry): entry for entry in baseline['results']}
+    for entry in report['results']:
+        old = previous.get(_entry_key(entry))
+        if old is not None:
+            entry['speedup'] = entry['mb_per_s'] / old['mb_per_s']
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='aes.py benchmark', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--key-sizes', nargs='+', type=int, default=KEY_SIZES, choices=KEY_SIZES)
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=DEFAULT_SIZES,
+                        help='message sizes, e.g. 16 1K 64M (default: %(default)s)')
+    parser.add_argument('--engines', nargs='+', default=('matrix',), choices=AES.engines)
+    parser.add_argument('--no-functions', dest='functions', action='store_false',
+                        help='skip the high-level encrypt/decrypt functions')
+    parser.add_argument('--repeat', type=int, default=5, help='minimum calls per measurement')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per measurement')
+    parser.add_argument('--workload', type=int, default=100000, help='PBKDF2 iterations for encrypt/decrypt')
+    parser.add_argument('--baseline', type=argparse.FileType('r'),
+                        help='JSON report of a previous run to compute speedups against')
+    args = parser.parse_args(argv)
+
+    report = run(args.modes, args.key_sizes, args.sizes, args.engines, args.functions,
+                 args.repeat, args.min_time, args.workload)
+    if args.baseline:
+        compare(report, json.load(args.baseline))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Per-primitive profiler for aes.py.
+
+Breaks the time of each block mode down into the round primitives of the
+matrix and flat engines (`sub_bytes`, `mix_columns`, `add_round_key`, the
+`bytes2matrix` conversion, ...) and the XOR helpers of the mode loops, per
+mode and key size, and prints the report as JSON:
+
+    ./aes.py profile --modes cbc ctr --key-sizes 128 256 --size 4K
+
+Instrumentation replaces the module-level functions of `aes` with counting
+and timing wrappers while a `RoundProfiler` is enabled, and puts the
+originals back when it is disabled, so it costs nothing when off. The
+wrappers add about a microsecond per call, which inflates the totals but
+not the relative shares much. The table and bitslice engines do not call
+these primitives; their time shows up as 'other'.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+import aes
+from aes import AES
+from benchmark import parse_size
+
+PRIMITIVES = (
+    'bytes2matrix', 'matrix2bytes',
+    'sub_bytes', 'inv_sub_bytes', 'shift_rows', 'inv_shift_rows',
+    'mix_columns', 'inv_mix_columns', 'inv_sub_mix_columns', 'add_round_key',
+    'sub_bytes_flat', 'inv_sub_bytes_flat', 'shift_rows_flat', 'inv_shift_rows_flat',
+    'mix_columns_flat', 'inv_mix_columns_flat', 'inv_sub_mix_columns_flat', 'add_round_key_flat',
+    'xor_bytes', 'xor_into', 'xor_span', 'counter_blocks',
+)
+MODES = ('cbc', 'pcbc', 'cfb', 'ofb', 'ctr')
+KEY_SIZES = (128, 192, 256)
+
+
+class RoundProfiler:
+    """
+    Counts calls and measures the time spent in each of the `primitives`
+    functions of the `aes` module while enabled. Time is exclusive: a
+    primitive calling another one (`inv_mix_columns` calls `mix_columns`) is
+    only charged for its own part.
+
+    Use `enable`/`disable` or the profiler as a context manager.
+    """
+    def __init__(self, primitives=PRIMITIVES):
+        self.primitives = primitives
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self._originals = None
+        self._stack = []
+
+    @property
+    def enabled(self):
+        return self._originals is not None
+
+    def _wrap(self, name, function):
+        calls, seconds, stack = self.calls, self.seconds, self._stack
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            stack.append(0.0)
+            start = clock()
+            try:
+                return function(*args)
+            finally:
+                elapsed = clock() - start
+                seconds[name] += elapsed - stack.pop()
+                calls[name] += 1
+                if stack:
+                    stack[-1] += elapsed
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    def enable(self):
+        """ Installs the wrappers in the `aes` module. """
+        assert not self.enabled, 'Profiler already enabled.'
+        self._originals = {name: getattr(aes, name) for name in self.primitives}
+        for name, function in self._originals.items():
+            setattr(aes, name, self._wrap(name, function))
+
+    def disable(self):
+        """ Restores the original functions. """
+        assert self.enabled, 'Profiler not enabled.'
+        for name, function in self._originals.items():
+            setattr(aes, name, function)
+        self._originals = None
+
+    def reset(self):
+        self.calls.clear()
+        self.seconds.clear()
+
+    def breakdown(self, total):
+        """
+        Returns {primitive: {'calls', 'seconds', 'share'}} for the primitives
+        called, plus 'other' for the rest of `total` seconds.
+        """
+        report = {name: {'calls': self.calls[name], 'seconds': self.seconds[name],
+                         'share': self.seconds[name] / total}
+                  for name in sorted(self.calls, key=self.seconds.get, reverse=True)}
+        other = total - sum(self.seconds.values())
+        report['other'] = {'calls': None, 'seconds': other, 'share': other / total}
+        return report
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+
+def profile(modes=MODES, key_sizes=KEY_SIZES, size=4096, engine='matrix'):
+    """
+    Encrypts and decrypts a `size` byte message in each mode and key size
+    with the profiler enabled, returning the breakdown of every run.
+    """
+    results = []
+    message = os.urandom(size)
+    iv = os.urandom(16)
+    profiler = RoundProfiler()
+    for key_bits in key_sizes:
+        cipher = AES(os.urandom(key_bits // 8), engine)
+        for mode in modes:
+            ciphertext = getattr(cipher, 'encrypt_' + mode)(message, iv)
+            for operation, data in (('encrypt', message), ('decrypt', ciphertext)):
+                function = getattr(cipher, operation + '_' + mode)
+                profiler.reset()
+                with profiler:
+                    start = time.perf_counter()
+                    function(data, iv)
+                    total = time.perf_counter() - start
+                results.append({'engine': engine, 'operation': operation, 'mode': mode,
+                                'key_bits': key_bits, 'message_bytes': size, 'seconds': total,
+                                'primitives': profiler.breakdown(total)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='aes.py profile', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--key-sizes', nargs='+', type=int, default=KEY_SIZES, choices=KEY_SIZES)
+    parser.add_argument('--size', type=parse_size, default=4096, help='message size, e.g. 4K')
+    parser.add_argument('--engine', default='matrix', choices=AES.engines)
+    args = parser.parse_args(argv)
+
+    json.dump(profile(args.modes, args.key_sizes, args.size, args.engine), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Asyncio front end for `aes.encrypt` and `aes.decrypt`.
+
+The PBKDF2 key stretching and the pure Python block cipher take hundreds of
+milliseconds per call, which would stall an event loop. `AESService` runs
+them in a process pool instead:
+
+    service = AESService(workers=4)
+    ciphertext = await service.encrypt(key, message)
+    plaintext = await service.decrypt(key, ciphertext)
+    await service.close()
+
+At most `max_in_flight` requests are queued or running at once; further
+callers wait in `encrypt`/`decrypt` until a slot frees up, so a burst of
+requests cannot grow the backlog without bound. Small requests waiting
+together are sent to a worker in a single call to save on IPC.
+"""
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aes
+
+
+def run_batch(jobs):
+    """
+    Runs `(operation, key, data, workload)` jobs, where operation is
+    'encrypt' or 'decrypt', and returns `(ok, result)` pairs in order: the
+    output, or the exception raised. Module-level so it can be sent to worker
+    processes.
+    """
+    results = []
+    for operation, key, data, workload in jobs:
+        try:
+            results.append((True, getattr(aes, operation)(key, data, workload)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class AESService:
+    """
+    Runs `aes.encrypt`/`aes.decrypt` off the event loop.
+
+    `executor` is any `concurrent.futures` executor; by default a
+    `ProcessPoolExecutor` with `workers` processes is created on first use and
+    shut down by `close`. `in_flight` counts the requests queued or running.
+
+    Requests of at most `small_size` bytes that are waiting at the same time
+    go to the executor in batches of up to `batch_size`; larger ones are sent
+    alone. `requests` and `batches` count them and the executor calls made.
+    """
+    def __init__(self, workers=None, max_in_flight=64, batch_size=16, small_size=4096,
+                 executor=None):
+        assert max_in_flight > 0 and batch_size > 0
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.small_size = small_size
+        self.batches = 0
+        self.requests = 0
+        self.in_flight = 0
+        self._executor = executor
+        self._own_executor = executor is None
+        self._slots = None
+        self._queue = None
+        self._dispatcher = None
+        self._running = set()
+        self._closed = False
+
+    async def encrypt(self, key, plaintext, workload=100000):
+        """
+        Encrypts `plaintext` like `aes.encrypt`, without blocking the loop.
+        """
+        return await self._submit('encrypt', key, plaintext, workload)
+
+    async def decrypt(self, key, ciphertext, workload=100000):
+        """
+        Decrypts `ciphertext` like `aes.decrypt`, without blocking the loop.
+        Raises the same AuthenticationError on corrupted or tampered data.
+        """
+        return await self._submit('decrypt', key, ciphertext, workload)
+
+    async def _submit(self, operation, key, data, workload):
+        if self._closed:
+            raise RuntimeError('Service closed.')
+        if self._dispatcher is None:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers)
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._queue = asyncio.Queue()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        async with self._slots:
+            # Closed while waiting for the slot.
+            if self._closed:
+                raise RuntimeError('Service closed.')
+            future = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait(((operation, key, data, workload), future))
+            self.requests += 1
+            self.in_flight += 1
+            try:
+                return await future
+            finally:
+                self.in_flight -= 1
+
+    async def _dispatch(self):
+        """
+        Takes requests off the queue, grouping the small ones that are
+        already waiting, and hands each group to the executor.
+        """
+        while True:
+            batch = [await self._queue.get()]
+            while (len(batch) < self.batch_size and not self._queue.empty() and
+                   len(batch[0][0][2]) <= self.small_size):
+                job, future = self._queue.get_nowait()
+                if len(job[2]) > self.small_size:
+                    self._start(self._run([(job, future)]))
+                    break
+                batch.append((job, future))
+            self._start(self._run(batch))
+
+    def _start(self, coroutine):
+        """ Runs `coroutine` in a task that `close` waits for. """
+        task = asyncio.ensure_future(coroutine)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        self.batches += 1
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, run_batch, [job for job, _ in batch])
+        except Exception as e:
+            results = [(False, e)] * len(batch)
+        for (_, future), (ok, result) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    async def close(self):
+        """
+        Fails the requests still queued or waiting for a slot, waits for the
+        running batches to finish, then shuts down the executor if it was
+        created by the service. Later requests raise RuntimeError.
+        """
+        self._closed = True
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                future.set_exception(RuntimeError('Service closed.'))
+            # Each finished request frees its slot, waking a waiter that then
+            # sees the service closed and frees the slot in turn.
+            await asyncio.gather(*self._running, return_exceptions=True)
+        if self._own_executor and self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def measure_loop_latency(load, interval=0.005):
+    """
+    Runs the coroutine `load` while sampling how late a timer on the event
+    loop fires every `interval` seconds. Returns the sorted delays in
+    seconds; a loop blocked by CPU work shows large delays.
+    """
+    delays = []
+    task = asyncio.ensure_future(load)
+    while not task.done():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        delays.append(time.perf_counter() - before - interval)
+    await task
+    return sorted(delays)
+
+
+async def _benchmark(n_requests, size, workload, workers):
+    key = b'benchmark key'
+    message = b'M' * size
+
+    async def blocking():
+        for _ in range(n_requests):
+            aes.encrypt(key, message, workload)
+            await asyncio.sleep(0)
+
+    async def offloaded(service):
+        await asyncio.gather(*(service.encrypt(key, message, workload) for _ in range(n_requests)))
+
+    async with AESService(workers) as service:
+        await service.encrypt(key, message, workload)  # Start the workers.
+        for name, load in (('inline', blocking()), ('service', offloaded(service))):
+            start = time.perf_counter()
+            delays = await measure_loop_latency(load)
+            elapsed = time.perf_counter() - start
+            p50, p99 = delays[len(delays) // 2], delays[min(len(delays) - 1, len(delays) * 99 // 100)]
+            print('%-8s %6.1f requests/s, loop delay p50 %7.2f ms, p99 %7.2f ms' % (
+                name, n_requests / elapsed, p50 * 1000, p99 * 1000))
+        print('service  %d requests in %d executor calls' % (service.requests - 1, service.batches - 1))
+
+
+if __name__ == '__main__':
+    import sys
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    asyncio.run(_benchmark(n_requests, 256, 10000, workers))
@@ -1,12 +1,41 @@
+import argparse
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import textwrap
+import threading
 import unittest
-from aes import AES, encrypt, decrypt
+from concurrent.futures import ThreadPoolExecutor
+from aes import AES, encrypt, decrypt, np, counter_blocks, inc_bytes, xor_span
+from aes import StreamEncryptor, StreamDecryptor, encrypt_stream, decrypt_stream
+from aes import encrypt_mmap, decrypt_mmap, pad, KeyScheduleCache, CtrReader, key_schedule_cache
+from aes import DerivedKeyCache, Session, get_key_iv, stretch_key, AuthenticationError
+from aes import enable_derived_key_cache, disable_derived_key_cache
+from aes import encrypt_container, decrypt_container, verify_container
+from aes import encrypt_many, decrypt_many
+from service import AESService
+
+
+def raised_optimized(code):
+    """
+    Runs `code` in a new interpreter under `python -O`, which strips asserts,
+    and returns the name of the exception it raised, or ''.
+    """
+    script = 'try:\n%s\nexcept Exception as e:\n    print(type(e).__name__)' % textwrap.indent(code, '    ')
+    result = subprocess.run([sys.executable, '-O', '-c', script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return result.stdout.strip()
 
 class TestBlock(unittest.TestCase):
     """
     Tests raw AES-128 block operations.
     """
+    engine = 'matrix'
+
     def setUp(self):
-        self.aes = AES(b'\00' * 16)
+        self.aes = AES(b'\00' * 16, self.engine)
 
     def test_success(self):
         """ Should be able to encrypt and decrypt block messages. """
@@ -21,10 +50,10 @@ class TestBlock(unittest.TestCase):
     def test_bad_key(self):
         """ Raw AES requires keys of an exact size. """
         with self.assertRaises(AssertionError):
-            AES(b'short key')
+            AES(b'short key', self.engine)
 
         with self.assertRaises(AssertionError):
-            AES(b'long key' * 10)
+            AES(b'long key' * 10, self.engine)
 
     def test_expected_value(self):
         """
@@ -33,39 +62,160 @@ class TestBlock(unittest.TestCase):
         """
         message = b'\x32\x43\xF6\xA8\x88\x5A\x30\x8D\x31\x31\x98\xA2\xE0\x37\x07\x34'
         key     = b'\x2B\x7E\x15\x16\x28\xAE\xD2\xA6\xAB\xF7\x15\x88\x09\xCF\x4F\x3C'
-        ciphertext = AES(bytes(key)).encrypt_block(bytes(message))
+        ciphertext = AES(bytes(key), self.engine).encrypt_block(bytes(message))
         self.assertEqual(ciphertext, b'\x39\x25\x84\x1D\x02\xDC\x09\xFB\xDC\x11\x85\x97\x19\x6A\x0B\x32')
 
+    def test_zeroize(self):
+        """ No round keys of the engine should survive `zeroize`. """
+        ciphertext = self.aes.encrypt_block(b'\01' * 16)
+        self.aes.zeroize()
+        self.assertNotEqual(self.aes.encrypt_block(b'\01' * 16), ciphertext)
+
 class TestKeySizes(unittest.TestCase):
     """
     Tests encrypt and decryption using 192- and 256-bit keys.
     """
+    engine = 'matrix'
+
     def test_192(self):
-        aes = AES(b'P' * 24)
+        aes = AES(b'P' * 24, self.engine)
         message = b'M' * 16
         ciphertext = aes.encrypt_block(message)
         self.assertEqual(aes.decrypt_block(ciphertext), message)
 
     def test_256(self):
-        aes = AES(b'P' * 32)
+        aes = AES(b'P' * 32, self.engine)
         message = b'M' * 16
         ciphertext = aes.encrypt_block(message)
         self.assertEqual(aes.decrypt_block(ciphertext), message)
 
     def test_expected_values192(self):
         message = b'\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xAA\xBB\xCC\xDD\xEE\xFF'
-        aes = AES(b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f\x10\x11\x12\x13\x14\x15\x16\x17')
+        aes = AES(b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f\x10\x11\x12\x13\x14\x15\x16\x17', self.engine)
         ciphertext = aes.encrypt_block(message)
         self.assertEqual(ciphertext, b'\xdd\xa9\x7c\xa4\x86\x4c\xdf\xe0\x6e\xaf\x70\xa0\xec\x0d\x71\x91')
         self.assertEqual(aes.decrypt_block(ciphertext), message)
 
     def test_expected_values256(self):
         message = b'\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xAA\xBB\xCC\xDD\xEE\xFF'
-        aes = AES(b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f\x10\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f')
+        aes = AES(b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f\x10\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f', self.engine)
         ciphertext = aes.encrypt_block(message)
         self.assertEqual(ciphertext, b'\x8e\xa2\xb7\xca\x51\x67\x45\xbf\xea\xfc\x49\x90\x4b\x49\x60\x89')
         self.assertEqual(aes.decrypt_block(ciphertext), message)
 
+class TestBlockTable(TestBlock):
+    """
+    Tests raw AES-128 block operations with the lookup-table engine.
+    """
+    engine = 'table'
+
+    def test_bad_engine(self):
+        """ Only known engines are accepted. """
+        with self.assertRaises(AssertionError):
+            AES(b'\00' * 16, 'unknown')
+
+    def test_same_as_matrix(self):
+        """ Both engines should produce byte-identical blocks. """
+        for key_size in (16, 24, 32):
+            key = bytes(range(key_size))
+            matrix, table = AES(key, 'matrix'), AES(key, 'table')
+            for i in range(64):
+                message = bytes((i * 7 + j) & 0xFF for j in range(16))
+                ciphertext = matrix.encrypt_block(message)
+                self.assertEqual(table.encrypt_block(message), ciphertext)
+                self.assertEqual(table.decrypt_block(ciphertext), message)
+
+class TestKeySizesTable(TestKeySizes):
+    """
+    Tests 192- and 256-bit keys with the lookup-table engine.
+    """
+    engine = 'table'
+
+class TestBlockBitsliced(TestBlock):
+    """
+    Tests raw AES-128 block operations with the bitsliced engine.
+    """
+    engine = 'bitslice'
+
+class TestKeySizesBitsliced(TestKeySizes):
+    """
+    Tests 192- and 256-bit keys with the bitsliced engine.
+    """
+    engine = 'bitslice'
+
+class TestBlockFlat(TestBlock):
+    """
+    Tests raw AES-128 block operations with the in-place flat engine.
+    """
+    engine = 'flat'
+
+    def test_state(self):
+        """ encrypt_state and decrypt_state modify the bytearray in place. """
+        message = b'a secret message'
+        state = bytearray(message)
+        self.aes.encrypt_state(state)
+        self.assertEqual(bytes(state), AES(b'\00' * 16).encrypt_block(message))
+        self.aes.decrypt_state(state)
+        self.assertEqual(state, message)
+
+class TestKeySizesFlat(TestKeySizes):
+    """
+    Tests 192- and 256-bit keys with the in-place flat engine.
+    """
+    engine = 'flat'
+
+class TestBatch(unittest.TestCase):
+    """
+    Tests encrypting and decrypting many independent blocks per call.
+    """
+    def setUp(self):
+        self.aes = AES(b'\00' * 16)
+        self.message = bytes(i & 0xFF for i in range(16 * 100))
+
+    def test_same_as_block(self):
+        """ Batches should match encrypting one block at a time. """
+        for key_size in (16, 24, 32):
+            aes = AES(bytes(range(key_size)))
+            ciphertext = aes.encrypt_blocks(self.message)
+            expected = b''.join(aes.encrypt_block(self.message[i:i+16])
+                                for i in range(0, len(self.message), 16))
+            self.assertEqual(ciphertext, expected)
+            self.assertEqual(aes.decrypt_blocks(ciphertext), self.message)
+
+    def test_bitsliced(self):
+        """ The bitsliced engine should match on whole batches too. """
+        for key_size in (16, 24, 32):
+            key = bytes(range(key_size))
+            ciphertext = AES(key).encrypt_blocks(self.message)
+            aes = AES(key, 'bitslice')
+            self.assertEqual(aes.encrypt_blocks(self.message), ciphertext)
+            self.assertEqual(aes.decrypt_blocks(ciphertext), self.message)
+
+    def test_partial_block(self):
+        """ Batches are made of whole blocks only. """
+        with self.assertRaises(AssertionError):
+            self.aes.encrypt_blocks(b'M' * 17)
+
+    @unittest.skipIf(np is None, 'NumPy is not installed.')
+    def test_array(self):
+        """ Arrays of states are accepted and returned as arrays. """
+        states = np.frombuffer(self.message, dtype=np.uint8).reshape(-1, 16)
+        ciphertext = self.aes.encrypt_blocks(states)
+        self.assertEqual(ciphertext.shape, (100, 16))
+        self.assertEqual(ciphertext.tobytes(), self.aes.encrypt_blocks(self.message))
+        self.assertTrue((self.aes.decrypt_blocks(ciphertext) == states).all())
+
+    def test_many_keys(self):
+        """ One key and IV per message, mixed key sizes and lengths. """
+        keys = [bytes([i]) * (16, 24, 32)[i % 3] for i in range(10)]
+        ivs = [bytes([i]) * 16 for i in range(9)] + [b'\xFF' * 16]
+        messages = [self.message[:i * 13] for i in range(10)]
+        for mode in ('cbc', 'ctr'):
+            ciphertexts = encrypt_many(keys, ivs, messages, mode)
+            for key, iv, message, ciphertext in zip(keys, ivs, messages, ciphertexts):
+                self.assertEqual(ciphertext, getattr(AES(key), 'encrypt_' + mode)(message, iv))
+            self.assertEqual(decrypt_many(keys, ivs, ciphertexts, mode), messages)
+
 
 class TestCbc(unittest.TestCase):
     """
@@ -124,6 +274,13 @@ class TestCbc(unittest.TestCase):
         ciphertext = self.aes.encrypt_cbc(long_message, self.iv)
         self.assertEqual(self.aes.decrypt_cbc(ciphertext, self.iv), long_message)
 
+    def test_parallel(self):
+        """ Batched decryption should match the serial path. """
+        long_message = bytes(i & 0xFF for i in range(1000))
+        ciphertext = self.aes.encrypt_cbc(long_message, self.iv)
+        self.assertEqual(self.aes.decrypt_cbc_parallel(ciphertext, self.iv, workers=2, chunk_size=160), long_message)
+        self.assertEqual(self.aes.decrypt_cbc_parallel(ciphertext, self.iv, workers=1), long_message)
+
 class TestPcbc(unittest.TestCase):
     """
     Tests AES-128 in CBC mode.
@@ -181,6 +338,13 @@ class TestPcbc(unittest.TestCase):
         ciphertext = self.aes.encrypt_pcbc(long_message, self.iv)
         self.assertEqual(self.aes.decrypt_pcbc(ciphertext, self.iv), long_message)
 
+    def test_parallel(self):
+        """ Batched decryption should match the serial path. """
+        long_message = bytes(i & 0xFF for i in range(1000))
+        ciphertext = self.aes.encrypt_pcbc(long_message, self.iv)
+        self.assertEqual(self.aes.decrypt_pcbc_parallel(ciphertext, self.iv, workers=2, chunk_size=160), long_message)
+        self.assertEqual(self.aes.decrypt_pcbc_parallel(ciphertext, self.iv, workers=1), long_message)
+
 class TestCfb(unittest.TestCase):
     """
     Tests AES-128 in CBC mode.
@@ -238,6 +402,13 @@ class TestCfb(unittest.TestCase):
         ciphertext = self.aes.encrypt_cfb(long_message, self.iv)
         self.assertEqual(self.aes.decrypt_cfb(ciphertext, self.iv), long_message)
 
+    def test_parallel(self):
+        """ Batched decryption should match the serial path. """
+        long_message = bytes(i & 0xFF for i in range(1000))
+        ciphertext = self.aes.encrypt_cfb(long_message, self.iv)
+        self.assertEqual(self.aes.decrypt_cfb_parallel(ciphertext, self.iv, workers=2, chunk_size=160), long_message)
+        self.assertEqual(self.aes.decrypt_cfb_parallel(ciphertext, self.iv, workers=1), long_message)
+
 class TestOfb(unittest.TestCase):
     """
     Tests AES-128 in CBC mode.
@@ -352,6 +523,104 @@ class TestCtr(unittest.TestCase):
         ciphertext = self.aes.encrypt_ctr(long_message, self.iv)
         self.assertEqual(self.aes.decrypt_ctr(ciphertext, self.iv), long_message)
 
+    def test_parallel(self):
+        """ Parallel CTR should match the serial path byte for byte. """
+        long_message = bytes(i & 0xFF for i in range(1000))
+        for iv in (self.iv, b'\xFF' * 16):
+            ciphertext = self.aes.encrypt_ctr(long_message, iv)
+            self.assertEqual(self.aes.encrypt_ctr_parallel(long_message, iv, workers=2, chunk_size=160), ciphertext)
+            self.assertEqual(self.aes.decrypt_ctr_parallel(ciphertext, iv, workers=2, chunk_size=160), long_message)
+            self.assertEqual(self.aes.decrypt_ctr_parallel(ciphertext, iv, workers=1), long_message)
+
+    def test_counter_blocks(self):
+        """ Counter blocks wrap around at 2^64 and 2^128 like inc_bytes. """
+        for start in (0, (1 << 64) - 3, (1 << 128) - 3):
+            counters = counter_blocks(start, 40)
+            block = start.to_bytes(16, 'big')
+            for i in range(40):
+                self.assertEqual(counters[16 * i:16 * i + 16], block)
+                block = inc_bytes(block)
+        long_message = bytes(i & 0xFF for i in range(1000))
+        self.assertEqual(xor_span(xor_span(long_message, self.message * 100), self.message * 100), long_message)
+
+
+class TestGcm(unittest.TestCase):
+    """
+    Tests AES in GCM mode.
+    """
+    def test_expected_values(self):
+        """
+        Test cases 1-4, 13 and 14 from the GCM specification:
+        https://csrc.nist.rip/groups/ST/toolkit/BCM/documents/proposedmodes/gcm/gcm-spec.pdf
+        """
+        aes = AES(bytes(16))
+        self.assertEqual(aes.encrypt_gcm(b'', bytes(12)),
+                         bytes.fromhex('58e2fccefa7e3061367f1d57a4e7455a'))
+        self.assertEqual(aes.encrypt_gcm(bytes(16), bytes(12)),
+                         bytes.fromhex('0388dace60b6a392f328c2b971b2fe78ab6e47d42cec13bdf53a67b21257bddf'))
+
+        aes = AES(bytes.fromhex('feffe9928665731c6d6a8f9467308308'))
+        iv = bytes.fromhex('cafebabefacedbaddecaf888')
+        message = bytes.fromhex('d9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72'
+                                '1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b391aafd255')
+        ciphertext = bytes.fromhex('42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e'
+                                   '21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091473f5985')
+        self.assertEqual(aes.encrypt_gcm(message, iv),
+                         ciphertext + bytes.fromhex('4d5c2af327cd64a62cf35abd2ba6fab4'))
+        associated_data = bytes.fromhex('feedfacedeadbeeffeedfacedeadbeefabaddad2')
+        self.assertEqual(aes.encrypt_gcm(message[:60], iv, associated_data),
+                         ciphertext[:60] + bytes.fromhex('5bc94fbc3221a5db94fae95ae7121a47'))
+        self.assertEqual(aes.decrypt_gcm(ciphertext[:60] + bytes.fromhex('5bc94fbc3221a5db94fae95ae7121a47'),
+                                         iv, associated_data), message[:60])
+
+        aes = AES(bytes(32))
+        self.assertEqual(aes.encrypt_gcm(b'', bytes(12)),
+                         bytes.fromhex('530f8afbc74536b9a963b4f1c4cb738b'))
+        self.assertEqual(aes.encrypt_gcm(bytes(16), bytes(12)),
+                         bytes.fromhex('cea7403d4d606b6e074ec5d3baf39d18d0d1c8a799996bf0265b98b5d48ab919'))
+
+    def test_long_iv(self):
+        """ IVs other than 96 bits are hashed into the first counter. """
+        aes = AES(b'\00' * 16)
+        message = b'M' * 100
+        for iv in (b'\01' * 8, b'\01' * 16, b'\01' * 60):
+            ciphertext = aes.encrypt_gcm(message, iv)
+            self.assertEqual(len(ciphertext), 116)
+            self.assertEqual(aes.decrypt_gcm(ciphertext, iv), message)
+
+    def test_integrity(self):
+        """ Tampered ciphertexts or associated data are rejected. """
+        aes = AES(b'\00' * 16)
+        iv = b'\01' * 12
+        ciphertext = aes.encrypt_gcm(b'my message', iv, b'header')
+        with self.assertRaises(AuthenticationError):
+            aes.decrypt_gcm(ciphertext, iv, b'other header')
+        with self.assertRaises(AuthenticationError):
+            aes.decrypt_gcm(b'a' + ciphertext[1:], iv, b'header')
+        with self.assertRaises(AuthenticationError):
+            aes.decrypt_gcm(ciphertext[:-1], iv, b'header')
+        with self.assertRaises(AuthenticationError):
+            aes.verify_gcm(ciphertext[:15], iv, b'header')
+
+    def test_optimized(self):
+        """ Tampering is detected even when asserts are disabled. """
+        for ciphertext in ('ciphertext[:-1] + b"a"', 'ciphertext[:15]'):
+            self.assertEqual(raised_optimized("""
+from aes import AES
+aes = AES(bytes(16))
+ciphertext = aes.encrypt_gcm(b'my message', bytes(12))
+aes.decrypt_gcm(%s, bytes(12))
+""" % ciphertext), 'AuthenticationError')
+
+    def test_zeroize(self):
+        """ Zeroizing the key also wipes the GHASH table derived from it. """
+        aes = AES(b'\00' * 16)
+        aes.encrypt_gcm(b'my message', b'\01' * 12)
+        table = aes._gcm_table
+        aes.zeroize()
+        self.assertFalse(hasattr(aes, '_gcm_table'))
+        self.assertTrue(all(v == 0 for row in table for v in row))
+
 class TestFunctions(unittest.TestCase):
     """
     Tests the module functions `encrypt` and `decrypt`, as well as basic
@@ -406,6 +675,492 @@ class TestFunctions(unittest.TestCase):
             ciphertext = ciphertext[:-1] + b'a'
             self.decrypt(self.key, ciphertext)
 
+    def test_optimized(self):
+        """ Tampering is detected even when asserts are disabled. """
+        self.assertEqual(raised_optimized("""
+from aes import encrypt, decrypt
+ciphertext = encrypt(b'key', b'message', 1000)
+decrypt(b'key', ciphertext[:-1] + bytes([ciphertext[-1] ^ 1]), 1000)
+"""), 'AuthenticationError')
+
+class TestInto(unittest.TestCase):
+    """
+    Tests in-place encryption into preallocated buffers.
+    """
+    engine = 'matrix'
+
+    def setUp(self):
+        self.aes = AES(b'\00' * 16, self.engine)
+        self.iv = b'\01' * 16
+        self.message = bytes(i & 0xFF for i in range(100))
+
+    def test_same_as_modes(self):
+        """ Should produce the same bytes as the padded block modes. """
+        padded = pad(self.message)
+        for mode in AES.into_modes:
+            ciphertext = bytearray(len(padded))
+            self.aes.encrypt_into(mode, padded, ciphertext, self.iv)
+            self.assertEqual(ciphertext, getattr(self.aes, 'encrypt_' + mode)(self.message, self.iv))
+
+            plaintext = bytearray(len(padded))
+            self.aes.decrypt_into(mode, memoryview(ciphertext), plaintext, self.iv)
+            self.assertEqual(plaintext, padded)
+
+    def test_chaining(self):
+        """ The returned chaining value continues the stream, also in place. """
+        padded = pad(self.message)
+        for mode in AES.into_modes:
+            expected = bytearray(len(padded))
+            self.aes.encrypt_into(mode, padded, expected, self.iv)
+
+            buffer = bytearray(padded)
+            view = memoryview(buffer)
+            iv = self.aes.encrypt_into(mode, view[:32], view[:32], self.iv)
+            self.aes.encrypt_into(mode, view[32:], view[32:], iv)
+            self.assertEqual(buffer, expected)
+
+    def test_mmap(self):
+        """ Files encrypted through mmap should round trip. """
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ('plain', 'cipher', 'decrypted')]
+            with open(paths[0], 'wb') as f:
+                f.write(self.message)
+            encrypt_mmap(self.aes, paths[0], paths[1], self.iv, 'ctr')
+            with open(paths[1], 'rb') as f:
+                self.assertEqual(f.read(), self.aes.encrypt_ctr(self.message, self.iv))
+            decrypt_mmap(self.aes, paths[1], paths[2], self.iv, 'ctr')
+            with open(paths[2], 'rb') as f:
+                self.assertEqual(f.read(), self.message)
+
+
+class TestIntoBitsliced(TestInto):
+    """
+    Tests in-place encryption with the bitsliced engine.
+    """
+    engine = 'bitslice'
+
+    def test_no_tables(self):
+        """ The bitsliced engine should not fall back to the T-table round. """
+        def table_round(*words):
+            raise AssertionError('T-table round used.')
+        self.aes._encrypt_columns = self.aes._decrypt_columns = table_round
+        self.test_same_as_modes()
+
+
+class TestKeyScheduleCache(unittest.TestCase):
+    """
+    Tests the LRU cache of expanded key schedules.
+    """
+    def test_hits(self):
+        """ Repeated keys should reuse the same expanded schedule. """
+        cache = KeyScheduleCache(maxsize=2)
+        aes = cache.get(b'\00' * 16)
+        self.assertIs(cache.get(b'\00' * 16), aes)
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 2})
+        self.assertEqual(aes.encrypt_block(b'M' * 16), AES(b'\00' * 16).encrypt_block(b'M' * 16))
+
+    def test_eviction(self):
+        """ The least recently used key is evicted, and zeroized once unused. """
+        cache = KeyScheduleCache(maxsize=2)
+        with cache.use(b'\01' * 16) as first:
+            cache.get(b'\02' * 16)
+            with cache.use(b'\01' * 16) as again:
+                self.assertIs(again, first)
+            second = cache.get(b'\02' * 16)
+            cache.get(b'\03' * 32)
+            self.assertEqual(len(cache), 2)
+            self.assertIs(cache.get(b'\02' * 16), second)
+            self.assertEqual(first.encrypt_block(b'M' * 16), AES(b'\01' * 16).encrypt_block(b'M' * 16))
+        self.assertEqual(first._encrypt_words, [0] * 44)
+        with cache.use(b'\01' * 16) as aes:
+            self.assertIsNot(aes, first)
+
+    def test_get(self):
+        """ Objects returned by `get` are never zeroized by the cache. """
+        cache = KeyScheduleCache(maxsize=1)
+        aes = cache.get(b'\00' * 16)
+        cache.get(b'\01' * 16)
+        cache.clear()
+        self.assertEqual(aes.encrypt_block(b'M' * 16), AES(b'\00' * 16).encrypt_block(b'M' * 16))
+
+    def test_invalidate(self):
+        """ Invalidated entries are zeroized and expanded again. """
+        cache = KeyScheduleCache()
+        with cache.use(b'\00' * 16) as aes:
+            pass
+        cache.invalidate(b'\00' * 16)
+        self.assertTrue(all(b == 0 for matrix in aes._key_matrices for column in matrix for b in column))
+        self.assertIsNot(cache.get(b'\00' * 16), aes)
+        cache.clear()
+        self.assertEqual(cache.info(), {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 32})
+
+    def test_threads(self):
+        """ Borrowed schedules stay intact while other threads evict them. """
+        cache = KeyScheduleCache(maxsize=4)
+        keys = [bytes([i]) * 16 for i in range(40)]
+        expected = [AES(key).encrypt_block(b'M' * 16) for key in keys]
+
+        def borrow(i):
+            with cache.use(keys[i % len(keys)]) as aes:
+                return [aes.encrypt_block(b'M' * 16) for _ in range(5)]
+
+        with ThreadPoolExecutor(64) as executor:
+            results = list(executor.map(borrow, range(400)))
+        for i, result in enumerate(results):
+            self.assertEqual(result, [expected[i % len(keys)]] * 5)
+        self.assertLessEqual(len(cache), 4)
+
+    def test_encrypt_threads(self):
+        """ Concurrent `encrypt` calls do not disturb each other. """
+        messages = [b'message %d' % i for i in range(200)]
+        with ThreadPoolExecutor(64) as executor:
+            ciphertexts = list(executor.map(lambda m: encrypt(b'key', m, 10), messages))
+        self.assertEqual([decrypt(b'key', c, 10) for c in ciphertexts], messages)
+
+    def test_decrypt(self):
+        """ `decrypt` borrows the schedule for its key from the module cache. """
+        ciphertext = encrypt(b'key', b'message', 10)
+        key_schedule_cache.clear()
+        for _ in range(3):
+            self.assertEqual(decrypt(b'key', ciphertext, 10), b'message')
+        self.assertEqual(key_schedule_cache.info()['misses'], 1)
+        self.assertEqual(key_schedule_cache.info()['hits'], 2)
+
+
+class TestDerivedKeyCache(unittest.TestCase):
+    """
+    Tests caching of PBKDF2 results and the session API.
+    """
+    def setUp(self):
+        self.now = 0
+        self.cache = DerivedKeyCache(maxsize=2, ttl=10, clock=lambda: self.now)
+
+    def test_hits(self):
+        """ Derived keys are reused for the same password, salt and workload. """
+        value = self.cache.get(b'password', b'salt', 1000)
+        self.assertEqual(value, stretch_key(b'password', b'salt', 1000))
+        self.assertEqual(self.cache.get(b'password', b'salt', 1000), value)
+        self.assertNotEqual(self.cache.get(b'password', b'salt', 1001), value)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_bounds(self):
+        """ Entries expire after `ttl` and the oldest go first. """
+        self.cache.get(b'password', b'salt1', 1000)
+        self.now = 11
+        self.cache.get(b'password', b'salt1', 1000)
+        self.assertEqual(self.cache.expired, 1)
+
+        self.cache.get(b'password', b'salt2', 1000)
+        self.cache.get(b'password', b'salt3', 1000)
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get(b'password', b'salt1', 1000)
+        self.assertEqual(self.cache.misses, 5)
+
+    def test_threads(self):
+        """ Concurrent lookups keep the cache bounded and the counters exact. """
+        cache = DerivedKeyCache(maxsize=4)
+        salts = [b'salt %d' % i for i in range(8)]
+        expected = {salt: stretch_key(b'password', salt, 10) for salt in salts}
+
+        with ThreadPoolExecutor(64) as executor:
+            results = list(executor.map(lambda i: cache.get(b'password', salts[i % 8], 10), range(400)))
+        for i, result in enumerate(results):
+            self.assertEqual(result, expected[salts[i % 8]])
+        self.assertLessEqual(len(cache), 4)
+        self.assertEqual(cache.hits + cache.misses, 400)
+
+    def test_enable(self):
+        """ Once enabled, `get_key_iv` goes through the module cache. """
+        cache = enable_derived_key_cache()
+        try:
+            get_key_iv(b'password', b'salt', 1000)
+            get_key_iv(b'password', b'salt', 1000)
+            self.assertEqual(cache.info()['hits'], 1)
+        finally:
+            disable_derived_key_cache()
+
+    def test_session(self):
+        """ Sessions encrypt with fresh IVs and decrypt each other's messages. """
+        session = Session(b'password', 1000)
+        ciphertext1 = session.encrypt(b'message')
+        ciphertext2 = session.encrypt(b'message')
+        self.assertNotEqual(ciphertext1, ciphertext2)
+        self.assertEqual(session.decrypt(ciphertext1), b'message')
+        self.assertEqual(Session(b'password', 1000).decrypt(ciphertext2), b'message')
+
+        with self.assertRaises(AuthenticationError):
+            session.decrypt(ciphertext1[:-1] + bytes([ciphertext1[-1] ^ 1]))
+        self.assertEqual(raised_optimized("""
+from aes import Session
+session = Session(b'password', 1000)
+ciphertext = session.encrypt(b'message')
+session.decrypt(ciphertext[:-1] + bytes([ciphertext[-1] ^ 1]))
+"""), 'AuthenticationError')
+
+
+class TestStream(unittest.TestCase):
+    """
+    Tests incremental encryption and the streaming file helpers.
+    """
+    def setUp(self):
+        self.aes = AES(b'\00' * 16)
+        self.iv = b'\01' * 16
+        self.key = b'master key'
+        self.message = bytes(i & 0xFF for i in range(1000))
+
+    def test_same_as_modes(self):
+        """ Feeding pieces of any size should match the one-shot modes. """
+        for mode in StreamEncryptor.modes:
+            for length in (0, 15, 16, 17, 1000):
+                message = self.message[:length]
+                encryptor = StreamEncryptor(self.aes, self.iv, mode)
+                ciphertext = b''.join(encryptor.update(message[i:i+7]) for i in range(0, length, 7))
+                ciphertext += encryptor.finalize()
+                self.assertEqual(ciphertext, getattr(self.aes, 'encrypt_' + mode)(message, self.iv))
+
+                decryptor = StreamDecryptor(self.aes, self.iv, mode)
+                plaintext = b''.join(decryptor.update(ciphertext[i:i+5]) for i in range(0, len(ciphertext), 5))
+                plaintext += decryptor.finalize()
+                self.assertEqual(plaintext, message)
+
+    def test_finalized(self):
+        """ A finalized encryptor cannot be reused. """
+        encryptor = StreamEncryptor(self.aes, self.iv)
+        encryptor.finalize()
+        with self.assertRaises(AssertionError):
+            encryptor.update(self.message)
+
+    def test_compatible(self):
+        """ Streams should use the same format as `encrypt` and `decrypt`. """
+        destination = io.BytesIO()
+        encrypt_stream(self.key, io.BytesIO(self.message), destination, 10000, chunk_size=100)
+        self.assertEqual(decrypt(self.key, destination.getvalue(), 10000), self.message)
+
+        plaintext = io.BytesIO()
+        decrypt_stream(self.key, io.BytesIO(encrypt(self.key, self.message, 10000)), plaintext, 10000, chunk_size=33)
+        self.assertEqual(plaintext.getvalue(), self.message)
+
+    def test_integrity(self):
+        """ Nothing is written when the ciphertext was tampered with. """
+        ciphertext = encrypt(self.key, self.message, 10000)
+        plaintext = io.BytesIO()
+        with self.assertRaises(AssertionError):
+            decrypt_stream(self.key, io.BytesIO(ciphertext[:-1] + bytes([ciphertext[-1] ^ 1])), plaintext, 10000)
+        self.assertEqual(plaintext.getvalue(), b'')
+
+    def test_changed(self):
+        """ Ciphertext changed after the first pass is still rejected. """
+        class Changing(io.BytesIO):
+            def seek(self, *args):
+                self.getbuffer()[-1] ^= 1
+                return super().seek(*args)
+
+        plaintext = io.BytesIO()
+        with self.assertRaises(AuthenticationError):
+            decrypt_stream(self.key, Changing(encrypt(self.key, self.message, 10000)), plaintext, 10000)
+        self.assertEqual(plaintext.getvalue(), self.message[:992])
+
+    def test_optimized(self):
+        """ Tampering is detected even when asserts are disabled. """
+        self.assertEqual(raised_optimized("""
+import io
+from aes import encrypt, decrypt_stream
+ciphertext = encrypt(b'key', b'message', 1000)
+decrypt_stream(b'key', io.BytesIO(ciphertext[:-1] + bytes([ciphertext[-1] ^ 1])), io.BytesIO(), 1000)
+"""), 'AuthenticationError')
+
+class TestService(unittest.TestCase):
+    """
+    Tests the asyncio AESService.
+    """
+    def test_process_pool(self):
+        """ Results match aes.encrypt/decrypt; errors reach the caller. """
+        async def run():
+            async with AESService(workers=1) as service:
+                ciphertext = await service.encrypt(b'key', b'message', 10)
+                self.assertEqual(decrypt(b'key', ciphertext, 10), b'message')
+                self.assertEqual(await service.decrypt(b'key', ciphertext, 10), b'message')
+                with self.assertRaises(AssertionError):
+                    await service.decrypt(b'wrong key', ciphertext, 10)
+        asyncio.run(run())
+
+    def test_batching_and_backpressure(self):
+        """ Concurrent small requests share executor calls, within the limit. """
+        async def run():
+            service = AESService(max_in_flight=4, batch_size=3,
+                                 executor=ThreadPoolExecutor(1))
+            peak = 0
+            async def request(i):
+                nonlocal peak
+                message = b'M' * (i * 1000)
+                ciphertext = await service.encrypt(b'key', message, 10)
+                peak = max(peak, service.in_flight)
+                self.assertEqual(decrypt(b'key', ciphertext, 10), message)
+            await asyncio.gather(*(request(i) for i in range(10)))
+            await service.close()
+            self.assertEqual(service.requests, 10)
+            self.assertLess(service.batches, 10)
+            self.assertLessEqual(peak, 4)
+            self.assertEqual(service.in_flight, 0)
+        asyncio.run(run())
+
+    def test_close(self):
+        """ Closing finishes running requests and fails the waiting ones. """
+        async def run():
+            executor = ThreadPoolExecutor(1)
+            gate = threading.Event()
+            executor.submit(gate.wait)
+            service = AESService(max_in_flight=1, executor=executor)
+            requests = [asyncio.ensure_future(service.encrypt(b'key', b'message', 10)) for _ in range(3)]
+            while not service.batches:
+                await asyncio.sleep(0.001)
+            # The first request is stuck behind the gate, the others wait for its slot.
+            gate.set()
+            await service.close()
+            done = await asyncio.wait_for(asyncio.gather(*requests, return_exceptions=True), 10)
+            self.assertEqual(decrypt(b'key', done[0], 10), b'message')
+            self.assertIsInstance(done[1], RuntimeError)
+            self.assertIsInstance(done[2], RuntimeError)
+            self.assertEqual(service.in_flight, 0)
+            with self.assertRaises(RuntimeError):
+                await service.encrypt(b'key', b'message', 10)
+        asyncio.run(run())
+
+class TestContainer(unittest.TestCase):
+    """
+    Tests the chunked authenticated container format.
+    """
+    def encrypt(self, message, chunk_size=64, **kwargs):
+        destination = io.BytesIO()
+        encrypt_container(b'key', io.BytesIO(message), destination, 10, chunk_size, **kwargs)
+        return destination.getvalue()
+
+    def decrypt(self, container, **kwargs):
+        destination = io.BytesIO()
+        decrypt_container(b'key', io.BytesIO(container), destination, 10, **kwargs)
+        return destination.getvalue()
+
+    def test_success(self):
+        """ Any length, including empty and whole chunks, round trips. """
+        for length in (0, 1, 63, 64, 65, 200):
+            message = bytes(i & 0xFF for i in range(length))
+            container = self.encrypt(message, workers=1)
+            # Header, one tag per chunk and a last chunk shorter than 64.
+            self.assertEqual(len(container), 25 + length + 16 * (length // 64 + 1))
+            verify_container(b'key', io.BytesIO(container), 10, workers=1)
+            self.assertEqual(self.decrypt(container, workers=1), message)
+
+    def test_parallel(self):
+        """ Process pools produce the same chunks. """
+        message = bytes(i & 0xFF for i in range(1000))
+        container = self.encrypt(message, workers=2)
+        self.assertEqual(self.decrypt(container, workers=2), message)
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(self.decrypt(container, executor=executor), message)
+
+    def test_tampering(self):
+        """ Bad chunks, truncation and reordering are detected. """
+        message = b'M' * 200
+        container = self.encrypt(message)
+        chunk = 64 + 16
+        broken = bytearray(container)
+        broken[25 + chunk + 3] ^= 1
+        with self.assertRaisesRegex(AuthenticationError, 'Chunk 1'):
+            verify_container(b'key', io.BytesIO(bytes(broken)), 10)
+        destination = io.BytesIO()
+        with self.assertRaises(AuthenticationError):
+            decrypt_container(b'key', io.BytesIO(bytes(broken)), destination, 10)
+        self.assertEqual(destination.getvalue(), message[:64])
+
+        for damaged in (container[:25 + chunk],
+                        container[:25] + container[25 + chunk:25 + 2 * chunk] + container[25:25 + chunk] + container[25 + 2 * chunk:]):
+            with self.assertRaises(AssertionError):
+                verify_container(b'key', io.BytesIO(damaged), 10)
+        with self.assertRaises(AssertionError):
+            self.decrypt(self.encrypt(b'other') + container[25:])
+        with self.assertRaises(AssertionError):
+            decrypt_container(b'wrong key', io.BytesIO(container), io.BytesIO(), 10)
+
+    def test_optimized(self):
+        """ Tampering is detected even when asserts are disabled. """
+        for function in ('verify_container(b"key", source, 10, workers=1)',
+                         'decrypt_container(b"key", source, io.BytesIO(), 10, workers=2)'):
+            self.assertEqual(raised_optimized("""
+import io
+from aes import encrypt_container, decrypt_container, verify_container
+container = io.BytesIO()
+encrypt_container(b'key', io.BytesIO(b'M' * 200), container, 10, 64, workers=1)
+broken = bytearray(container.getvalue())
+broken[-1] ^= 1
+source = io.BytesIO(bytes(broken))
+%s
+""" % function), 'AuthenticationError')
+
+class TestCtrReader(unittest.TestCase):
+    """
+    Tests random access reads of CTR ciphertext.
+    """
+    def setUp(self):
+        self.aes = AES(b'\00' * 16)
+        self.message = bytes(i & 0xFF for i in range(1000))
+
+    def test_ranges(self):
+        """ Any range matches the same slice of the plaintext. """
+        for iv in (b'\01' * 16, b'\xFF' * 16):
+            ciphertext = self.aes.encrypt_ctr(self.message, iv)
+            for source in (ciphertext, io.BytesIO(ciphertext)):
+                reader = CtrReader(self.aes, source, iv)
+                self.assertEqual(reader.size, len(self.message))
+                for offset, length in ((0, 1000), (0, 1), (15, 2), (17, 100), (990, 100), (1000, 5), (2000, 5)):
+                    self.assertEqual(reader.read(offset, length), self.message[offset:offset + length])
+
+    def test_unpadded(self):
+        """ Without padding the whole ciphertext is plaintext. """
+        iv = b'\01' * 16
+        ciphertext = self.aes.encrypt_ctr(self.message, iv)[:1000]
+        reader = CtrReader(self.aes, ciphertext, iv, padded=False)
+        self.assertEqual(reader.size, 1000)
+        self.assertEqual(reader.read(500, 1000), self.message[500:])
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests the benchmark harness on a tiny configuration.
+    """
+    def test_run(self):
+        import benchmark
+        self.assertEqual(benchmark.parse_size('64K'), 65536)
+        for text in ('0', '65M', '1G', 'K', ''):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                benchmark.parse_size(text)
+        self.assertEqual(benchmark.percentile([1, 2, 3, 4], 50), 2)
+        report = benchmark.run(modes=('cbc', 'ctr'), key_sizes=(128,), sizes=('16',),
+                               engines=('table',), repeat=1, min_time=0, workload=1000)
+        self.assertEqual(len(report['results']), 6)
+        benchmark.compare(report, report)
+        self.assertTrue(all(entry['speedup'] == 1 for entry in report['results']))
+
+    def test_profile(self):
+        import aes, profiler
+        original = aes.sub_bytes
+        results = profiler.profile(modes=('cbc',), key_sizes=(192,), size=32)
+        self.assertIs(aes.sub_bytes, original)
+        encryption = results[0]['primitives']
+        # 3 blocks of 12 rounds each.
+        self.assertEqual(encryption['sub_bytes']['calls'], 36)
+        self.assertEqual(encryption['bytes2matrix']['calls'], 3)
+        self.assertEqual(results[1]['primitives']['inv_sub_mix_columns']['calls'], 33)
+        self.assertEqual(results[1]['primitives']['inv_sub_bytes']['calls'], 3)
+
+    def test_profile_main(self):
+        """ The profile command accepts sizes with suffixes, as documented. """
+        import contextlib, json, profiler
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            profiler.main(['--modes', 'ctr', '--key-sizes', '128', '--size', '1K', '--engine', 'table'])
+        results = json.loads(output.getvalue())
+        self.assertEqual([r['message_bytes'] for r in results], [1024, 1024])
+
 
 def run():
     unittest.main()
@@ -1,6 +1,6 @@
 import random
 
-from util import gcd, get_multiplicative_inverse
+from util import gcd, get_multiplicative_inverse, modular_pow, FixedBaseExponentiation
 
 # EIGamal Encryption
 """
@@ -29,18 +29,43 @@ def to_EIGamal_Encryption(p, g, m, dB, secret_key=None):
     """
     # generate a random number
     k = random.randint(1, p - 2) if secret_key == None else secret_key
-    M = dB ** k % p # mask
+    M = modular_pow(dB, k, p) # mask
     while M == 1:
         if secret_key != None:
             print('Secret Key IS BAD CHOICE!, PLEASE CHOOSE AGAIN!')
             return
         elif secret_key == None:
             k = random.randint(1, p - 2)
-        M = dB ** k % p
+        M = modular_pow(dB, k, p)
     C = m * M % p # ciphertext
-    H = g ** k % p  # hint
+    H = modular_pow(g, k, p)  # hint
     return (C, H)
 
+class EIGamal_Sender:
+    """
+    to_EIGamal_Encryption for many messages to the same receiver: g and dB
+    are the bases of every exponentiation, so their powers are precomputed
+    once (util.FixedBaseExponentiation) and each message costs two table
+    products instead of two exponentiations
+    """
+    def __init__(self, p, g, dB):
+        self.p = p
+        self.__g = FixedBaseExponentiation(g, p, p.bit_length())
+        self.__dB = FixedBaseExponentiation(dB, p, p.bit_length())
+
+    def encrypt(self, m):
+        """
+        Return (C, H) like to_EIGamal_Encryption, with a random k
+
+        params: m, integer m < p
+        return (C, H)
+        """
+        M = 1
+        while M == 1:
+            k = random.randint(1, self.p - 2)
+            M = self.__dB.pow(k) # mask
+        return (m * M % self.p, self.__g.pow(k))
+
 def to_EIGamal_decryption(from_A, p, CB):
     """
     B decrypt through (C,H) which get from A and private key CB
@@ -51,7 +76,7 @@ def to_EIGamal_decryption(from_A, p, CB):
     """
     C, H = from_A
     q = p - 1 - CB
-    R = (H ** q) % p # opener
+    R = modular_pow(H, q, p) # opener
     m = C * R % p
     return m
 
@@ -71,7 +96,7 @@ def to_EIGamal_DigitalSignature_as_sender(p, g, r, R, M):
             Y = (M - r * X) * R^-1 mod (p - 1)
     """
     assert gcd(R, p-1) == 1, '{%d , %d} is not coprime.'%(R, p-1)
-    X = g ** R % p
+    X = modular_pow(g, R, p)
     R_inv = get_multiplicative_inverse(R, p-1)
     Y = (M - r * X) * R_inv % (p - 1)
     return M, X, Y
@@ -90,5 +115,5 @@ def is_message_from_A_EIGamal_DigitalSignature_as_receiver(from_A, p, g, K):
     return True or False
     """
     M, X, Y = from_A
-    A = (K ** X) * (X ** Y) % p
-    return A == g ** M % p
+    A = modular_pow(K, X, p) * modular_pow(X, Y, p) % p
+    return A == modular_pow(g, M, p)
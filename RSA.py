@@ -1,4 +1,12 @@
-from util import isprime, get_multiplicative_inverse
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+
+from util import gcd, isprime, get_multiplicative_inverse, get_random_prime, modular_pow, powmod, to_powmod_int
 
 # RSA cryptosystem
 # RSA ALGORITHM
@@ -16,6 +24,12 @@ RSA ALGORITHM
 c = m ^ e mod n 
 <Decryption>
 m = c ^ d mod n
+or, with the Chinese Remainder Theorem (CRT), from the secret p and q:
+dP = d mod (p-1), dQ = d mod (q-1), qInv = q ^ (-1) mod p
+m1 = c ^ dP mod p, m2 = c ^ dQ mod q
+m = m2 + q * (qInv * (m1 - m2) mod p)
+Both exponentiations have half-size exponents and moduli, about 4 times
+less work than c ^ d mod n.
 """
 class RSA:
     """
@@ -28,6 +42,27 @@ class RSA:
         self.__n = p * q
         self.__phi = (p - 1) * (q - 1) # the sum of numbers relatively prime to n
     
+    @classmethod
+    def generate(cls, bits=2048, e=65537):
+        """
+        Return a new RSA object with a random `bits`-bit modulus and public
+        exponent e, from two probable primes of bits // 2 bits each
+        (util.get_random_prime: sieving and Miller-Rabin)
+
+        params: bits, integer, even
+                e, integer, odd
+        return: RSA
+        """
+        assert bits % 2 == 0 and bits >= 64
+        coprime = lambda p: gcd(e, p - 1) == 1
+        p = get_random_prime(bits // 2, coprime)
+        q = get_random_prime(bits // 2, coprime)
+        while q == p:
+            q = get_random_prime(bits // 2, coprime)
+        rsa = cls(p, q)
+        rsa.set_e(e)
+        return rsa
+
     def generate_candidates(self, amount=10):
         """
         e * d = 1 (mod phi)
@@ -45,9 +80,13 @@ class RSA:
         return candidates
 
     def set_e(self, e):
-        assert gcd(e, self.__phi) == 1, '%d and %d is not coprime.'%(e, self.phi)
+        assert gcd(e, self.__phi) == 1, '%d and %d is not coprime.'%(e, self.__phi)
         self.__e = e
         self.__d = get_multiplicative_inverse(self.__e, self.__phi)
+        # CRT parameters for decrypt
+        self.__dP = self.__d % (self.__p - 1)
+        self.__dQ = self.__d % (self.__q - 1)
+        self.__qInv = get_multiplicative_inverse(self.__q, self.__p)
         self.public_key = (self.__n, self.__e)
 
     def encrypt(self, msg):
@@ -57,22 +96,95 @@ class RSA:
         params: msg, integer
         return: ciphertext, integer
         """
-        ciphertext = msg ** self.__e % self.__n
+        ciphertext = modular_pow(msg, self.__e, self.__n)
         return ciphertext
 
     def decrypt(self, ciphertext):
         """
-        Return plaintext
+        Return plaintext, using the CRT
+
+        params: ciphertext, integer
+        return: msg, integer
+        """
+        m1 = modular_pow(ciphertext, self.__dP, self.__p)
+        m2 = modular_pow(ciphertext, self.__dQ, self.__q)
+        h = self.__qInv * (m1 - m2) % self.__p
+        msg = m2 + h * self.__q
+        return msg
+
+    def decrypt_without_crt(self, ciphertext):
+        """
+        Return plaintext such that ciphertext ^ d mod n, without the CRT
 
         params: ciphertext, integer
         return: msg, integer
         """
-        msg = ciphertext ** self.__d % self.__n
+        msg = modular_pow(ciphertext, self.__d, self.__n)
         return msg
 
+    def encrypt_batch(self, msgs, workers=1, executor=None, chunk_size=1024):
+        """
+        Return the list of ciphertexts of msgs, see decrypt_batch
+
+        params: msgs, list of integers
+        return: ciphertexts, list of integers
+        """
+        return _run_batch(self, '_encrypt_values', msgs, workers, executor, chunk_size)
+
+    def decrypt_batch(self, ciphertexts, workers=1, executor=None, chunk_size=1024):
+        """
+        Return the list of plaintexts of ciphertexts, with the CRT
+
+        The key is converted once to the integers of util.powmod (gmpy2's when
+        installed) and every message goes through one loop, instead of a
+        method call each. With `workers` other than 1 (None: one per CPU) or
+        an `executor`, chunks of `chunk_size` messages run in worker
+        processes.
+
+        params: ciphertexts, list of integers
+        return: msgs, list of integers
+        """
+        return _run_batch(self, '_decrypt_values', ciphertexts, workers, executor, chunk_size)
+
+    def _encrypt_values(self, msgs):
+        e, n = to_powmod_int(self.__e), to_powmod_int(self.__n)
+        return [int(powmod(msg, e, n)) for msg in msgs]
+
+    def _decrypt_values(self, ciphertexts):
+        p, q = to_powmod_int(self.__p), to_powmod_int(self.__q)
+        dP, dQ, qInv = to_powmod_int(self.__dP), to_powmod_int(self.__dQ), to_powmod_int(self.__qInv)
+        msgs = []
+        for ciphertext in ciphertexts:
+            m2 = powmod(ciphertext, dQ, q)
+            msgs.append(int(m2 + qInv * (powmod(ciphertext, dP, p) - m2) % p * q))
+        return msgs
+
     def get_public_key(self):
         return self.__n, self.__e
 
+def _run_values(rsa, method, values):
+    """
+    Return rsa.<method>(values); module-level so it can run in worker
+    processes
+    """
+    return getattr(rsa, method)(values)
+
+def _run_batch(rsa, method, values, workers, executor, chunk_size):
+    """
+    Run rsa.<method> over values in this process if workers is 1 and there
+    is no executor, else in chunks on `executor` or a new process pool
+    """
+    values = list(values)
+    if executor is None and workers == 1:
+        return getattr(rsa, method)(values)
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if executor is not None:
+        results = executor.map(_run_values, repeat(rsa), repeat(method), chunks)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_run_values, repeat(rsa), repeat(method), chunks))
+    return [value for chunk in results for value in chunk]
+
 class RSA_Digital_Signature:
     """
     SENDER A: public key:{m, e}, private key:d
@@ -84,22 +196,252 @@ class RSA_Digital_Signature:
                 sender: tuple, {p, q, e} create a new RSA object
                 receiver: tuple, {r, s, h} 
         """
-        self.sender = RSA(sender[:2])
-        self.receiver = RSA(receiver[:2])
+        self.sender = RSA(*sender[:2])
+        self.receiver = RSA(*receiver[:2])
         self.sender.set_e(sender[-1])
         self.receiver.set_e(receiver[-1])
         self.sender_public_key = self.sender.public_key
         self.receiver_public_key = self.receiver.public_key
 
     def sender_encrypt(self, msg):
+        """
+        Sign msg with the sender's private key (CRT), then encrypt the
+        signature for the receiver; the sender's modulus must not exceed the
+        receiver's
+        """
         n, h = self.receiver_public_key
-        sign = self.sender.encrypt(msg)
-        ciphertext = sign ** h % n
+        sign = self.sender.decrypt(msg)
+        ciphertext = modular_pow(sign, h, n)
         return ciphertext
 
     def receiver_decrypt(self, ciphertext):
         m, e = self.sender_public_key
         z = self.receiver.decrypt(ciphertext)
-        plaintext = z ** e % m
+        plaintext = modular_pow(z, e, m)
         return plaintext
 
+    def sender_encrypt_batch(self, msgs, workers=1, executor=None):
+        """
+        sender_encrypt for a list of messages, see RSA.decrypt_batch
+        """
+        signs = self.sender.decrypt_batch(msgs, workers, executor)
+        return self.receiver.encrypt_batch(signs, workers, executor)
+
+    def receiver_decrypt_batch(self, ciphertexts, workers=1, executor=None):
+        """
+        receiver_decrypt for a list of ciphertexts, see RSA.decrypt_batch
+        """
+        zs = self.receiver.decrypt_batch(ciphertexts, workers, executor)
+        m, e = self.sender_public_key
+        m, e = to_powmod_int(m), to_powmod_int(e)
+        return [int(powmod(z, e, m)) for z in zs]
+
+
+def generate_key(bits, e=65537):
+    """
+    Return RSA.generate(bits, e); module-level so it can run in worker
+    processes
+    """
+    return RSA.generate(bits, e)
+
+class RSA_Key_Pool:
+    """
+    Keeps up to `capacity` pre-generated RSA objects of each size in `sizes`.
+    A process pool generates them in the background: it fills the pool at
+    start, and again up to `capacity` whenever `get` leaves fewer than
+    `low_water` keys of a size. If the pool is empty, `get` generates the key
+    itself. `executor` replaces the process pool of `workers` processes; it
+    is then left running by `close`.
+
+    with RSA_Key_Pool(sizes=(2048, 4096), capacity=8) as pool:
+        rsa = pool.get(2048)
+    """
+    def __init__(self, sizes=(2048,), capacity=8, low_water=None, workers=None, e=65537,
+                 executor=None):
+        assert capacity > 0
+        self.sizes = tuple(sizes)
+        self.capacity = capacity
+        self.low_water = capacity // 2 if low_water is None else low_water
+        self.e = e
+        self.__keys = {bits: deque() for bits in self.sizes}
+        self.__pending = dict.fromkeys(self.sizes, 0)
+        self.__generated = dict.fromkeys(self.sizes, 0)
+        self.__handed_out = dict.fromkeys(self.sizes, 0)
+        self.__misses = dict.fromkeys(self.sizes, 0)
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.__start = time.monotonic()
+        self.__own_executor = executor is None
+        self.__executor = ProcessPoolExecutor(workers) if executor is None else executor
+        for bits in self.sizes:
+            self.__refill(bits)
+
+    def __refill(self, bits):
+        """
+        Submit enough keys of the size to bring it back to `capacity`,
+        counting those already being generated
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            needed = self.capacity - len(self.__keys[bits]) - self.__pending[bits]
+            self.__pending[bits] += needed
+            futures = [self.__executor.submit(generate_key, bits, self.e) for _ in range(needed)]
+        # Outside the lock: the callback runs at once if the key is ready.
+        for future in futures:
+            future.add_done_callback(partial(self.__add, bits))
+
+    def __add(self, bits, future):
+        with self.__lock:
+            self.__pending[bits] -= 1
+            if future.cancelled() or future.exception() is not None or self.__closed:
+                return
+            self.__keys[bits].append(future.result())
+            self.__generated[bits] += 1
+
+    def get(self, bits=2048):
+        """
+        Return a fresh RSA object of the given size, with e set
+
+        params: bits, integer, one of `sizes`
+        return: RSA
+        """
+        assert bits in self.__keys, 'No pool for %d-bit keys.' % bits
+        assert not self.__closed, 'Key pool closed.'
+        with self.__lock:
+            keys = self.__keys[bits]
+            rsa = keys.popleft() if keys else None
+            self.__handed_out[bits] += 1
+            if rsa is None:
+                self.__misses[bits] += 1
+            low = len(keys) < self.low_water
+        if low:
+            self.__refill(bits)
+        return rsa if rsa is not None else RSA.generate(bits, self.e)
+
+    def metrics(self):
+        """
+        Return a dict per key size: keys ready ('depth'), keys being
+        generated ('pending'), keys 'generated' in the background and their
+        rate per second since start ('refill_rate'), keys 'handed_out', and
+        'misses' (`get` on an empty pool)
+        """
+        with self.__lock:
+            elapsed = time.monotonic() - self.__start
+            return {bits: {'depth': len(self.__keys[bits]),
+                           'pending': self.__pending[bits],
+                           'generated': self.__generated[bits],
+                           'refill_rate': self.__generated[bits] / elapsed,
+                           'handed_out': self.__handed_out[bits],
+                           'misses': self.__misses[bits]}
+                    for bits in self.sizes}
+
+    def close(self, wait=True):
+        """
+        Stop refilling: cancel the keys not started yet, wait for the worker
+        processes to exit if `wait`, and drop the keys left in the pool
+        """
+        with self.__lock:
+            self.__closed = True
+        if self.__own_executor:
+            self.__executor.shutdown(wait=wait, cancel_futures=True)
+        with self.__lock:
+            for keys in self.__keys.values():
+                keys.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Benchmark
+def _time(function, *args, repeat=10):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(*args)
+    return (time.perf_counter() - start) / repeat
+
+def benchmark(sizes=(1024, 2048, 4096), repeat=10):
+    """
+    Print the time of one decryption for each modulus size: CRT,
+    c ^ d mod n with three-argument pow, and the former `c ** d % n` where it
+    is feasible at all (only for toy keys: the intermediate power of a
+    k-bit number has about k * d bits).
+    """
+    rsa = RSA(61, 53)
+    rsa.set_e(17)
+    c = rsa.encrypt(65)
+    naive = lambda c: c ** 2753 % 3233
+    print('%5d bits: c ** d %% n %8.3f ms, pow %8.3f ms, CRT %8.3f ms' % (
+        12, _time(naive, c, repeat=repeat) * 1000, _time(rsa.decrypt_without_crt, c, repeat=repeat) * 1000,
+        _time(rsa.decrypt, c, repeat=repeat) * 1000))
+    for bits in sizes:
+        rsa = RSA.generate(bits)
+        n, _ = rsa.get_public_key()
+        msg = random.randrange(2, n)
+        c = rsa.encrypt(msg)
+        assert rsa.decrypt(c) == rsa.decrypt_without_crt(c) == msg
+        full = _time(rsa.decrypt_without_crt, c, repeat=repeat)
+        crt = _time(rsa.decrypt, c, repeat=repeat)
+        print('%5d bits: c ** d %% n      n/a, pow %8.3f ms, CRT %8.3f ms (%.1fx)' % (
+            bits, full * 1000, crt * 1000, full / crt))
+
+
+def benchmark_keygen(sizes=(2048, 3072, 4096), duration=10.0):
+    """
+    Print how many keys of each size RSA.generate makes per second, over
+    at least `duration` seconds per size (the time per key varies a lot).
+    """
+    for bits in sizes:
+        start = time.perf_counter()
+        keys = 0
+        while keys == 0 or time.perf_counter() - start < duration:
+            RSA.generate(bits)
+            keys += 1
+        elapsed = time.perf_counter() - start
+        print('%5d bits: %6.2f keys/s, %7.3f s per key (%d keys)' % (bits, keys / elapsed, elapsed / keys, keys))
+
+def benchmark_pool(bits=2048, requests=20, interval=0.05):
+    """
+    Print the latency of RSA_Key_Pool.get for `requests` requests, one every
+    `interval` seconds, once the pool is full, and the pool metrics
+    """
+    with RSA_Key_Pool((bits,), capacity=8) as pool:
+        while pool.metrics()[bits]['depth'] < pool.capacity:
+            time.sleep(0.1)
+        latencies = []
+        for _ in range(requests):
+            latencies.append(_time(pool.get, bits, repeat=1))
+            time.sleep(interval)
+        latencies.sort()
+        print('%5d bits: get p50 %.3f ms, max %.3f ms' % (
+            bits, latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+        print(pool.metrics()[bits])
+
+def benchmark_batch(bits=2048, count=2000, workers=None):
+    """
+    Print the time to decrypt `count` messages with RSA.decrypt in a loop
+    and with RSA.decrypt_batch, in this process and in a process pool
+    """
+    rsa = RSA.generate(bits)
+    n, _ = rsa.get_public_key()
+    ciphertexts = [random.randrange(2, n) for _ in range(count)]
+    loop = _time(lambda: [rsa.decrypt(c) for c in ciphertexts], repeat=1)
+    batch = _time(rsa.decrypt_batch, ciphertexts, repeat=1)
+    pool = _time(lambda: rsa.decrypt_batch(ciphertexts, workers, chunk_size=count // 16 or 1), repeat=1)
+    print('%5d bits, %d messages: loop %.3f s, batch %.3f s, process pool %.3f s' % (
+        bits, count, loop, batch, pool))
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ['keygen']:
+        benchmark_keygen()
+    elif sys.argv[1:] == ['pool']:
+        benchmark_pool()
+    elif sys.argv[1:] == ['batch']:
+        benchmark_batch()
+    else:
+        benchmark()
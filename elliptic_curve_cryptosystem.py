@@ -6,7 +6,7 @@
 import random
 import math
 
-from util import isprime, get_multiplicative_inverse, get_modular_exponentiation_from_left
+from util import isprime, get_multiplicative_inverse, modular_pow
 
 # Point P and Q in E, plot a straight line through the points. This
 # line will necessarily intersect the curve at a third point--R'
@@ -118,14 +118,14 @@ def computing_square_roots(a, b, p, x):
     # step4: Compute a^-1 mod p
     inver_a = get_multiplicative_inverse(equ_right, p)
     # step5: 
-    c = b ** t % p
-    r = get_modular_exponentiation_from_left(equ_right, (t+1)//2, p)
+    c = modular_pow(b, t, p)
+    r = modular_pow(equ_right, (t+1)//2, p)
     # step6:
     for i in range(1, s):
-        d = pow((r ** 2 * inver_a), pow(2, s - i - 1)) % p
-        if d % p == -1:
+        d = modular_pow(r * r * inver_a, 2 ** (s - i - 1), p)
+        if d == p - 1:
             r = r * c % p
-            c = c ** 2 % p
+        c = c * c % p
     r = abs(r)
     return (r, p-r)
 
@@ -0,0 +1,153 @@
+import random
+import time
+import unittest
+from concurrent.futures import Executor, Future
+
+from RSA import RSA, RSA_Digital_Signature, RSA_Key_Pool
+
+
+class ImmediateExecutor(Executor):
+    """ Runs each task in `submit`, returning a future that is already done. """
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+class StalledExecutor(Executor):
+    """ Never runs anything, so every key request misses. """
+    def submit(self, function, *args):
+        return Future()
+
+
+class TestRSA(unittest.TestCase):
+    """
+    Tests RSA key generation and decryption with the CRT.
+    """
+    def test_textbook(self):
+        """ The classic example: p = 61, q = 53, e = 17, so d = 2753. """
+        rsa = RSA(61, 53)
+        rsa.set_e(17)
+        self.assertEqual(rsa.get_public_key(), (3233, 17))
+        self.assertEqual(rsa.encrypt(65), 2790)
+        self.assertEqual(rsa.decrypt(2790), 65)
+        self.assertEqual(rsa.decrypt_without_crt(2790), 65)
+
+    def test_generate(self):
+        """ Generated moduli have exactly the requested number of bits. """
+        for bits in (64, 512, 1024, 2048):
+            rsa = RSA.generate(bits)
+            n, e = rsa.get_public_key()
+            self.assertEqual(n.bit_length(), bits)
+            self.assertEqual(e, 65537)
+        self.assertEqual(RSA.generate(512, e=3).get_public_key()[1], 3)
+
+    def test_crt(self):
+        """ CRT decryption agrees with c ^ d mod n and inverts encryption. """
+        for bits in (64, 512, 1024):
+            rsa = RSA.generate(bits)
+            n, _ = rsa.get_public_key()
+            for msg in [0, 1, 2, n - 1] + [random.randrange(n) for _ in range(20)]:
+                ciphertext = rsa.encrypt(msg)
+                self.assertEqual(rsa.decrypt(ciphertext), rsa.decrypt_without_crt(ciphertext))
+                self.assertEqual(rsa.decrypt(ciphertext), msg)
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Tests batch encryption, decryption and signatures.
+    """
+    def setUp(self):
+        self.rsa = RSA.generate(512)
+        n, _ = self.rsa.get_public_key()
+        self.msgs = [0, 1, n - 1] + [random.randrange(n) for _ in range(20)]
+
+    def test_round_trip(self):
+        """ Batches match the single-message methods and round trip. """
+        ciphertexts = self.rsa.encrypt_batch(self.msgs)
+        self.assertEqual(ciphertexts, [self.rsa.encrypt(msg) for msg in self.msgs])
+        self.assertEqual(self.rsa.decrypt_batch(ciphertexts), self.msgs)
+        self.assertEqual(self.rsa.decrypt_batch([]), [])
+
+    def test_pool(self):
+        """ Batches split over worker processes keep their order. """
+        ciphertexts = self.rsa.encrypt_batch(self.msgs, workers=2, chunk_size=5)
+        self.assertEqual(ciphertexts, self.rsa.encrypt_batch(self.msgs))
+        self.assertEqual(self.rsa.decrypt_batch(ciphertexts, workers=2, chunk_size=5), self.msgs)
+
+    def test_signature(self):
+        """ Signed and encrypted messages are recovered by the receiver. """
+        signature = RSA_Digital_Signature((61, 53, 17), (67, 71, 13))
+        self.assertEqual(signature.receiver_decrypt(signature.sender_encrypt(42)), 42)
+        msgs = list(range(0, 3233, 97))
+        ciphertexts = signature.sender_encrypt_batch(msgs)
+        self.assertEqual(ciphertexts, [signature.sender_encrypt(msg) for msg in msgs])
+        self.assertEqual(signature.receiver_decrypt_batch(ciphertexts), msgs)
+        self.assertEqual(signature.receiver_decrypt_batch(ciphertexts, workers=2), msgs)
+
+
+class TestKeyPool(unittest.TestCase):
+    """
+    Tests the pool of pre-generated RSA keys.
+    """
+    def wait_for_depth(self, pool, bits, depth, timeout=60):
+        deadline = time.monotonic() + timeout
+        while pool.metrics()[bits]['depth'] < depth:
+            self.assertLess(time.monotonic(), deadline, 'Pool not refilled in time.')
+            time.sleep(0.01)
+
+    def test_refill(self):
+        """ The pool fills up, and refills once below the low-water mark. """
+        with RSA_Key_Pool((256, 512), capacity=4, low_water=2, workers=2) as pool:
+            self.wait_for_depth(pool, 512, 4)
+            keys = [pool.get(512) for _ in range(3)]
+            self.wait_for_depth(pool, 512, 4)
+            metrics = pool.metrics()[512]
+            self.assertEqual(metrics['generated'], 7)
+            self.assertEqual((metrics['handed_out'], metrics['misses'], metrics['pending']), (3, 0, 0))
+            self.assertGreater(metrics['refill_rate'], 0)
+            self.wait_for_depth(pool, 256, 4)
+            self.assertEqual(pool.metrics()[256]['handed_out'], 0)
+        for rsa in keys:
+            n, _ = rsa.get_public_key()
+            self.assertEqual(n.bit_length(), 512)
+            self.assertEqual(rsa.decrypt(rsa.encrypt(12345)), 12345)
+        self.assertEqual(len({rsa.get_public_key() for rsa in keys}), 3)
+
+    def test_ready_futures(self):
+        """ Keys that are ready when submitted do not deadlock the refill. """
+        pool = RSA_Key_Pool((256,), capacity=3, low_water=3, executor=ImmediateExecutor())
+        self.assertEqual(pool.metrics()[256]['depth'], 3)
+        pool.get(256)
+        self.assertEqual(pool.metrics()[256]['depth'], 3)
+        self.assertEqual(pool.metrics()[256]['generated'], 4)
+        pool.close()
+
+    def test_miss(self):
+        """ An empty pool generates the key in `get` and counts a miss. """
+        pool = RSA_Key_Pool((256,), capacity=2, executor=StalledExecutor())
+        rsa = pool.get(256)
+        self.assertEqual(rsa.get_public_key()[0].bit_length(), 256)
+        metrics = pool.metrics()[256]
+        self.assertEqual((metrics['depth'], metrics['pending']), (0, 2))
+        self.assertEqual((metrics['handed_out'], metrics['misses']), (1, 1))
+        with self.assertRaises(AssertionError):
+            pool.get(512)
+        pool.close()
+
+    def test_close(self):
+        """ A closed pool drops its keys and refuses requests. """
+        pool = RSA_Key_Pool((256,), capacity=2, executor=ImmediateExecutor())
+        pool.close()
+        self.assertEqual(pool.metrics()[256]['depth'], 0)
+        with self.assertRaises(AssertionError):
+            pool.get(256)
+
+        pool = RSA_Key_Pool((256,), capacity=2, workers=1)
+        pool.close()
+        self.assertEqual(pool.metrics()[256]['depth'], 0)
+        self.assertEqual(pool.metrics()[256]['pending'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,15 @@
 # Author: GerogeLiu
 
 import random
+import secrets
+
+# gmpy2 (GMP) is optional: its modular exponentiation is about 10 times
+# faster than the built-in pow on 1024-bit and larger numbers.
+try:
+    from gmpy2 import mpz as to_powmod_int, powmod
+except ImportError:
+    powmod = pow
+    to_powmod_int = int
 
 # Find divisors
 def find_divisors(n):
@@ -48,6 +57,138 @@ def isprime(n):
             return False
     return True
 
+# small primes, by the sieve of Eratosthenes
+def get_small_primes(limit):
+    """
+    Return the list of primes below limit
+
+    params: limit, integer
+    return: primes, list
+
+    >>> get_small_primes(30)
+    [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+    """
+    sieve = bytearray([1]) * limit
+    sieve[:2] = b'\x00\x00'
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i*i::i] = bytes(len(range(i*i, limit, i)))
+    return [i for i in range(limit) if sieve[i]]
+
+SMALL_PRIMES = get_small_primes(1 << 16)
+
+
+# Miller-Rabin probabilistic primality test
+def miller_rabin(n, rounds=40):
+    """
+    Return False if n is composite, True if n is probably prime: a composite
+    passes each round with probability at most 1/4 (far less for random
+    candidates). n - 1 = 2^s * d with d odd; n is composite unless for
+    each random base a, a^d = 1 or a^(2^r * d) = -1 (mod n) for some r < s.
+
+    params: n, odd integer > 3
+            rounds, integer, number of random bases
+    return: True or False
+    """
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for _ in range(rounds):
+        a = random.randrange(2, n - 1)
+        x = powmod(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def get_miller_rabin_rounds(bits):
+    """
+    Return the number of Miller-Rabin rounds for an error probability below
+    2^-100 on random candidates of the given size (FIPS 186-4, Table C.3)
+    """
+    if bits >= 1536:
+        return 4
+    if bits >= 1024:
+        return 5
+    if bits >= 512:
+        return 8
+    return 40
+
+def is_probable_prime(n, rounds=None):
+    """
+    Return True if n is prime with overwhelming probability, or False.
+    Divides by the small primes first, then runs Miller-Rabin.
+
+    params: n, integer
+            rounds, integer, Miller-Rabin rounds (default: by size of n)
+    return: True or False
+
+    >>> is_probable_prime(2 ** 127 - 1), is_probable_prime(2 ** 128 + 1)
+    (True, False)
+    """
+    if n < 2:
+        return False
+    for p in SMALL_PRIMES[:168]:
+        if n % p == 0:
+            return n == p
+    if n < 1000 ** 2:
+        return True
+    if rounds is None:
+        rounds = get_miller_rabin_rounds(n.bit_length())
+    return miller_rabin(n, rounds)
+
+# random prime generation
+def next_probable_prime(n, window=4096):
+    """
+    Return the smallest probable prime >= n, for n > 2^16
+
+    Incremental search: the odd numbers n, n+2, ... in a window are sieved
+    by all SMALL_PRIMES at once, using n mod p to find their multiples,
+    and only the survivors go through Miller-Rabin.
+
+    params: n, integer
+            window, integer, odd numbers sieved at a time
+    return: integer
+    """
+    assert n > SMALL_PRIMES[-1]
+    n |= 1
+    rounds = get_miller_rabin_rounds(n.bit_length())
+    while True:
+        composite = bytearray(window)
+        for p in SMALL_PRIMES[1:]:
+            # first k with n + 2k = 0 (mod p); (p + 1) // 2 is 2^(-1) mod p
+            k = -(n % p) * ((p + 1) // 2) % p
+            composite[k::p] = b'\x01' * len(range(k, window, p))
+        for k in range(window):
+            if not composite[k] and miller_rabin(n + 2 * k, rounds):
+                return n + 2 * k
+        n += 2 * window
+
+def get_random_prime(bits, condition=None):
+    """
+    Return a random probable prime of exactly `bits` bits whose two top bits
+    are set, so the product of two of them has exactly 2 * bits bits.
+    Starts from a random number (secrets module) and searches upwards with
+    next_probable_prime. `condition`, if given, is a function of the prime
+    that must return True, e.g. gcd(e, p - 1) == 1 for RSA.
+
+    params: bits, integer >= 17
+            condition, function
+    return: integer
+    """
+    assert bits > 16
+    while True:
+        p = next_probable_prime(secrets.randbits(bits) | (3 << (bits - 2)) | 1)
+        if p.bit_length() == bits and (condition is None or condition(p)):
+            return p
+
+
 # extended Euclidean Algorithm
 def extended_euclidean_algorithm(a, b):
     """
@@ -140,6 +281,216 @@ def get_modular_exponentiation_from_left(a, x, p):
             y = y * a % p
     return y
 
+# window size for sliding-window exponentiation
+def get_exponent_window_size(bits):
+    """
+    Return the window size k that minimizes the multiplications for an
+    exponent of the given number of bits: about bits / (k + 1) of them plus
+    2^(k-1) to build the table, on top of the bits squarings
+
+    params: bits, integer
+    return: k, integer
+    """
+    if bits > 671:
+        return 6
+    if bits > 239:
+        return 5
+    if bits > 79:
+        return 4
+    if bits > 23:
+        return 3
+    return 1
+
+# Montgomery arithmetic
+class MontgomeryContext:
+    """
+    Handbook of Applied cryptography by Menezes -- Algorithm 14.32
+    Montgomery multiplication modulo an odd n: numbers are kept in
+    Montgomery form aR mod n with R = 2^k > n, and the product of two of them
+    is reduced with shifts and masks (REDC) instead of a division by n:
+    REDC(T) = (T + m n) / R = T R^(-1) mod n, with m = T n' mod R and
+    n' = -n^(-1) mod R.
+
+    >>> ctx = MontgomeryContext(1000003)
+    >>> ctx.from_montgomery(ctx.mul(ctx.to_montgomery(1234), ctx.to_montgomery(5678)))
+    6631
+    >>> ctx.from_montgomery(ctx.pow(ctx.to_montgomery(1234), 5678)) == pow(1234, 5678, 1000003)
+    True
+    """
+    def __init__(self, modulus):
+        assert modulus > 1 and modulus % 2 == 1, 'The modulus must be odd.'
+        self.modulus = modulus
+        self.bits = modulus.bit_length()
+        self.R = 1 << self.bits
+        self.mask = self.R - 1
+        self.R2 = self.R * self.R % modulus # R^2 mod n, to convert into Montgomery form
+        self.n_prime = -get_multiplicative_inverse(modulus, self.R) % self.R
+        self.one = self.R % modulus # 1 in Montgomery form
+
+    def reduce(self, t):
+        """
+        Return t R^(-1) mod n, for 0 <= t < n R
+        """
+        t = (t + ((t & self.mask) * self.n_prime & self.mask) * self.modulus) >> self.bits
+        return t - self.modulus if t >= self.modulus else t
+
+    def to_montgomery(self, a):
+        """ Return aR mod n """
+        return self.reduce(a % self.modulus * self.R2)
+
+    def from_montgomery(self, a):
+        """ Return a R^(-1) mod n, the ordinary number of aR """
+        return self.reduce(a)
+
+    def mul(self, a, b):
+        """ Product of two numbers in Montgomery form """
+        return self.reduce(a * b)
+
+    def sqr(self, a):
+        """ Square of a number in Montgomery form """
+        return self.reduce(a * a)
+
+    def pow(self, a, x):
+        """
+        Return a ^ x in Montgomery form, for a in Montgomery form and x >= 0,
+        by the sliding window method
+        """
+        return get_modular_exponentiation_sliding_window(a, x, self.modulus, context=self)
+
+    def to_montgomery_many(self, numbers):
+        return [self.to_montgomery(a) for a in numbers]
+
+    def from_montgomery_many(self, numbers):
+        return [self.reduce(a) for a in numbers]
+
+    def mul_many(self, a, b):
+        """
+        Pairwise products of two lists of numbers in Montgomery form, with
+        the constants bound once for the whole list
+        """
+        n, n_prime, mask, bits = self.modulus, self.n_prime, self.mask, self.bits
+        products = []
+        for x, y in zip(a, b):
+            t = x * y
+            t = (t + ((t & mask) * n_prime & mask) * n) >> bits
+            products.append(t - n if t >= n else t)
+        return products
+
+    def pow_many(self, numbers, x):
+        """ Each of the numbers in Montgomery form to the power x """
+        return [self.pow(a, x) for a in numbers]
+
+
+# Modular Exponentiation(sliding window)
+def get_modular_exponentiation_sliding_window(a, x, p, k=None, context=None):
+    """
+    Handbook of Applied cryptography by Menezes -- Algorithm 14.85
+    Scans x from left to right in windows of at most k bits that start and
+    end with a 1 bit, using the precomputed odd powers a, a^3, ..., a^(2^k - 1):
+    one multiplication per window instead of one per 1 bit.
+
+    params: a: integer
+            x: positive integer
+            p: integer
+            k: integer, window size (default: get_exponent_window_size)
+            context: MontgomeryContext for p, to multiply with Montgomery
+                     reduction; a and the result are then in Montgomery form
+    return: a ^ x mod p: integer
+
+    >>> get_modular_exponentiation_sliding_window(3, 200, 1000003) == pow(3, 200, 1000003)
+    True
+    """
+    if k is None:
+        k = get_exponent_window_size(x.bit_length())
+    if context is None:
+        mul, a, y = lambda u, v: u * v % p, a % p, 1 % p
+    else:
+        mul, y = context.mul, context.one
+    a2 = mul(a, a)
+    odd_powers = [a]
+    for _ in range(2 ** (k - 1) - 1):
+        odd_powers.append(mul(odd_powers[-1], a2))
+
+    i = x.bit_length() - 1
+    while i >= 0:
+        if not (x >> i) & 1:
+            y = mul(y, y)
+            i -= 1
+            continue
+        # longest window x[i..j] of at most k bits ending with a 1 bit
+        j = max(i - k + 1, 0)
+        while not (x >> j) & 1:
+            j += 1
+        for _ in range(i - j + 1):
+            y = mul(y, y)
+        y = mul(y, odd_powers[((x >> j) & ((1 << (i - j + 1)) - 1)) >> 1])
+        i = j - 1
+    return y
+
+# Modular Exponentiation(fixed base)
+class FixedBaseExponentiation:
+    """
+    Precomputed powers of a fixed base modulo p, for many exponentiations
+    with the same base (a generator g, a public key): with
+    table[i][j] = base ^ (j * 2^(k*i)) mod p, base ^ x is the product of one
+    table entry per k-bit digit of x, without any squaring.
+
+    The table has ceil(max_bits / k) * 2^k entries.
+
+    >>> g = FixedBaseExponentiation(3, 1000003, 64)
+    >>> g.pow(200) == pow(3, 200, 1000003)
+    True
+    """
+    def __init__(self, base, modulus, max_bits, k=None):
+        # gmpy2 integers when installed, multiplied faster
+        modulus = to_powmod_int(modulus)
+        self.modulus = modulus
+        self.max_bits = max_bits
+        self.k = get_exponent_window_size(max_bits) if k is None else k
+        self.table = []
+        power = to_powmod_int(base) % modulus
+        for _ in range(-(-max_bits // self.k)):
+            row = [1 % modulus, power]
+            for _ in range(2 ** self.k - 2):
+                row.append(row[-1] * power % modulus)
+            self.table.append(row)
+            power = row[-1] * power % modulus
+
+    def pow(self, x):
+        """
+        Return base ^ x mod p, for 0 <= x < 2^max_bits
+        """
+        assert 0 <= x and x.bit_length() <= self.max_bits, 'Exponent out of range.'
+        p, k, mask = self.modulus, self.k, (1 << self.k) - 1
+        y = 1 % p
+        for row in self.table:
+            if not x:
+                break
+            digit = x & mask
+            if digit:
+                y = y * row[digit] % p
+            x >>= k
+        return int(y)
+
+# Modular Exponentiation engine
+def modular_pow(a, x, p):
+    """
+    Return a ^ x mod p: the modular exponentiation used by RSA, EIGamal and
+    the elliptic curve code
+
+    The built-in pow (gmpy2's powmod when installed) already runs a
+    sliding-window exponentiation in C, and beats the Python versions above
+    on a single exponentiation at every size (see
+    benchmark_modular_exponentiation); only FixedBaseExponentiation wins,
+    when the same base is reused.
+
+    params: a: integer
+            x: integer
+            p: integer
+    return: a ^ x mod p: integer
+    """
+    return int(powmod(a, x, p))
+
 
 
 # order of a modulo n
@@ -235,6 +586,58 @@ def prime_factorization(n):
     return factors
 
 
-
-
-
+# Benchmark
+def benchmark_modular_exponentiation(sizes=(256, 1024, 2048), repeat=3):
+    """
+    Print the time of one a ^ x mod p with x and p of each size, for the
+    binary methods, the sliding window, the built-in pow, modular_pow (the
+    same unless gmpy2 is installed) and a FixedBaseExponentiation (and the
+    time to build its table)
+    """
+    import time
+    for bits in sizes:
+        p = random.getrandbits(bits) | (1 << (bits - 1)) | 1
+        a, x = random.randrange(2, p), random.getrandbits(bits)
+        expected = pow(a, x, p)
+        start = time.perf_counter()
+        fixed = FixedBaseExponentiation(a, p, bits)
+        setup = time.perf_counter() - start
+        timings = []
+        for function in (get_modular_exponentiation_from_right, get_modular_exponentiation_from_left,
+                         get_modular_exponentiation_sliding_window, pow, modular_pow,
+                         lambda a, x, p: fixed.pow(x)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = function(a, x, p)
+            timings.append((time.perf_counter() - start) / repeat * 1000)
+            assert result == expected
+        print('%5d bits: right %7.2f ms, left %7.2f ms, sliding window %7.2f ms, pow %7.2f ms, '
+              'modular_pow %7.2f ms, fixed base %7.2f ms (table %.0f ms)' % (bits, *timings, setup * 1000))
+
+def benchmark_montgomery(sizes=(256, 1024, 2048, 4096, 8192, 16384), count=2000):
+    """
+    Print the time of one modular multiplication with a * b % n and with
+    MontgomeryContext.mul_many, for odd moduli of each size, to find the
+    size from which Montgomery reduction wins
+    """
+    import time
+    for bits in sizes:
+        n = random.getrandbits(bits) | (1 << (bits - 1)) | 1
+        ctx = MontgomeryContext(n)
+        a = [random.randrange(n) for _ in range(count)]
+        b = [random.randrange(n) for _ in range(count)]
+        am, bm = ctx.to_montgomery_many(a), ctx.to_montgomery_many(b)
+        start = time.perf_counter()
+        plain = [x * y % n for x, y in zip(a, b)]
+        plain_time = (time.perf_counter() - start) / count
+        start = time.perf_counter()
+        montgomery = ctx.mul_many(am, bm)
+        montgomery_time = (time.perf_counter() - start) / count
+        assert ctx.from_montgomery_many(montgomery) == plain
+        print('%5d bits: a * b %% n %8.2f us, Montgomery %8.2f us (%.2fx)' % (
+            bits, plain_time * 1e6, montgomery_time * 1e6, plain_time / montgomery_time))
+
+
+if __name__ == '__main__':
+    benchmark_modular_exponentiation()
+    benchmark_montgomery()